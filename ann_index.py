@@ -0,0 +1,181 @@
+import numpy as np
+
+# Rows assigned to centroids per matrix product, keeps k-means memory bounded
+ASSIGN_CHUNK_SIZE = 8192
+
+
+def _squared_norms(vectors):
+    return np.einsum("ij,ij->i", vectors, vectors)
+
+
+def _squared_distances(queries, query_norms, vectors, vector_norms):
+    squared = queries @ vectors.T
+    squared *= -2
+    squared += query_norms[:, None]
+    squared += vector_norms[None, :]
+    return squared
+
+
+def _assign(vectors, centroids):
+    """Return the index of the closest centroid for every row of vectors"""
+    centroid_norms = _squared_norms(centroids)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start : start + ASSIGN_CHUNK_SIZE]
+        squared = _squared_distances(
+            chunk, _squared_norms(chunk), centroids, centroid_norms
+        )
+        assignments[start : start + len(chunk)] = np.argmin(squared, axis=1)
+    return assignments
+
+
+def kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    """Plain Lloyd k-means, empty clusters are re-seeded from random points"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), empty.sum())]
+
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over face encodings.
+
+    Encodings are clustered with k-means into n_lists coarse cells and stored
+    contiguously per cell. A search only scans the n_probe cells closest to
+    the query and re-ranks that shortlist with exact distances, so n_probe is
+    the recall/latency knob: n_probe == n_lists is an exact linear scan.
+    """
+
+    def __init__(self, centroids, encodings, ids, offsets, n_probe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_norms = _squared_norms(self.centroids)
+        # Encodings sorted by cell, cell i lives in [offsets[i], offsets[i + 1])
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.norms = _squared_norms(self.encodings)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, encodings, n_lists=None, n_probe=8, n_iter=10, seed=0):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(encodings))))
+        n_lists = min(n_lists, len(encodings))
+
+        centroids = kmeans(encodings, n_lists, n_iter=n_iter, seed=seed)
+        assignments = _assign(encodings, centroids)
+
+        ids = np.argsort(assignments, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=n_lists))
+        return cls(centroids, encodings[ids], ids, offsets, n_probe=n_probe)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, encodings, ids):
+        """Insert encodings into their closest cells under the given ids.
+
+        Centroids are not retrained, rebuild once the gallery has changed a lot.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        cells = _assign(encodings, self.centroids)
+        # Append at the end of each cell so the cells stay contiguous
+        positions = self.offsets[cells + 1]
+        self.encodings = np.insert(self.encodings, positions, encodings, axis=0)
+        self.norms = np.insert(self.norms, positions, _squared_norms(encodings))
+        self.ids = np.insert(self.ids, positions, ids)
+        self.offsets[1:] += np.cumsum(np.bincount(cells, minlength=self.n_lists))
+
+    def remove(self, ids):
+        """Drop ids and shift the ids above them down, like deleting gallery rows"""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        keep = ~np.isin(self.ids, ids)
+        cells = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+        self.offsets[1:] = np.cumsum(
+            np.bincount(cells[keep], minlength=self.n_lists)
+        )
+        self.encodings = self.encodings[keep]
+        self.norms = self.norms[keep]
+        kept_ids = self.ids[keep]
+        self.ids = kept_ids - np.searchsorted(ids, kept_ids)
+
+    def search(self, queries, k=1, n_probe=None):
+        """Return (ids, distances) of shape (n_queries, k), closest first.
+
+        Ids index into the encodings the index was built from. Slots that
+        could not be filled from the probed cells hold -1 and inf.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+
+        result_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        result_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not len(queries) or not len(self):
+            return result_ids, result_distances
+
+        query_norms = _squared_norms(queries)
+        coarse = _squared_distances(
+            queries, query_norms, self.centroids, self.centroid_norms
+        )
+        probes = np.argpartition(coarse, n_probe - 1, axis=1)[:, :n_probe]
+
+        for row, cells in enumerate(probes):
+            candidates = np.concatenate(
+                [np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells]
+            )
+            if not len(candidates):
+                continue
+
+            squared = _squared_distances(
+                queries[row : row + 1],
+                query_norms[row : row + 1],
+                self.encodings[candidates],
+                self.norms[candidates],
+            )[0]
+            top = min(k, len(candidates))
+            best = np.argpartition(squared, top - 1)[:top]
+            best = best[np.argsort(squared[best])]
+
+            result_ids[row, :top] = self.ids[candidates[best]]
+            result_distances[row, :top] = np.sqrt(np.maximum(squared[best], 0))
+
+        return result_ids, result_distances
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                encodings=self.encodings,
+                ids=self.ids,
+                offsets=self.offsets,
+                n_probe=np.array(self.n_probe),
+            )
+
+    @classmethod
+    def load(cls, path, n_probe=None):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["centroids"],
+                data["encodings"],
+                data["ids"],
+                data["offsets"],
+                n_probe=n_probe or int(data["n_probe"]),
+            )
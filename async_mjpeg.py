@@ -0,0 +1,298 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+import time_log
+from channels import LatestChannel
+from mjpeg_reader import JpegFrame
+
+# Errors after which a stream reconnects
+STREAM_ERRORS = (OSError, EOFError, ValueError, asyncio.TimeoutError)
+
+
+def _parse_headers(lines):
+    headers = {}
+    for line in lines:
+        key, sep, value = line.partition(b":")
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+async def _connect(url, timeout, limit):
+    """GET url, return (reader, writer, chunked) once the headers are in"""
+    parts = urlsplit(url)
+    tls = parts.scheme == "https"
+    port = parts.port or (443 if tls else 80)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=tls or None, limit=limit),
+        timeout,
+    )
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+        "Accept: multipart/x-mixed-replace\r\nConnection: close\r\n\r\n".encode()
+    )
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except BaseException:
+        writer.close()
+        raise
+    status, *lines = head[:-4].split(b"\r\n")
+    if status.split()[1:2] != [b"200"]:
+        writer.close()
+        raise ConnectionError(f"{url} answered {status.decode(errors='replace')}")
+    headers = _parse_headers(lines)
+    return reader, writer, b"chunked" in headers.get(b"transfer-encoding", b"")
+
+
+def _dechunk(raw, body):
+    """Move the complete chunks of a chunked transfer from raw to body"""
+    while True:
+        line_end = raw.find(b"\r\n")
+        if line_end < 0:
+            return
+        size = int(bytes(raw[:line_end]).split(b";")[0], 16)
+        if size == 0:
+            raise ConnectionError("MJPEG stream ended")
+        end = line_end + 2 + size + 2
+        if len(raw) < end:
+            return
+        body += raw[line_end + 2 : end - 2]
+        del raw[:end]
+
+
+def split_parts(buffer):
+    """Complete multipart parts at the start of buffer as (headers, start, end).
+
+    start and end delimit the JPEG in buffer. Parts with a Content-Length
+    header are cut by length, others at the JPEG end-of-image marker.
+    """
+    parts = []
+    pos = 0
+    while True:
+        header_end = buffer.find(b"\r\n\r\n", pos)
+        if header_end < 0:
+            return parts
+        headers = _parse_headers(bytes(buffer[pos:header_end]).split(b"\r\n"))
+        start = header_end + 4
+        length = headers.get(b"content-length")
+        if length is not None:
+            end = start + int(length)
+            if end > len(buffer):
+                return parts
+        else:
+            end = buffer.find(b"\xff\xd9", start)
+            if end < 0:
+                return parts
+            end += 2
+        parts.append((headers, start, end))
+        pos = end
+
+
+class MjpegStream:
+    """One multipart MJPEG stream read by an asyncio task, newest part wins.
+
+    The boundary stream is parsed directly, so the client sees every part
+    and its headers. Everything that is already buffered is read at once;
+    when that holds several complete parts, only the newest is copied out
+    and the older ones are dropped unread (stale_parts). The newest part is
+    kept as a JpegFrame in frames, so a part that is replaced before anyone
+    takes it is never decoded either (dropped_frames), and one that is taken
+    is decoded only as far as its consumer asks.
+
+    The Pi's camera_server numbers its parts and stamps them with the
+    capture time. Gaps in the numbers are frames the server skipped for this
+    client (missed_frames). As the clocks differ, lag is how much later than
+    the quickest part seen so far a part arrived, which grows with the
+    backlog in the network and the socket buffers.
+
+    Frames are taken like from a LatestFrameReader, with latest(), next()
+    and read() from any thread, or with async for over parts() on the
+    stream's own event loop. Run it with start() on its MjpegClient's loop,
+    or await run() on your own.
+    """
+
+    def __init__(self, url, client=None, timeout=5.0, retry_delay=1.0, limit=1 << 20):
+        self.url = url
+        self.client = client
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        # Bytes the socket reader buffers, and reads at most at once
+        self.limit = limit
+        # Items are (frame_id, arrival timestamp, JpegFrame)
+        self.frames = LatestChannel()
+        self.received_parts = 0
+        self.stale_parts = 0
+        self.dropped_frames = 0
+        self.missed_frames = 0
+        self.failed_reads = 0
+        self.lag = time_log.Histogram()
+        self._frame_id = 0
+        self._last_seq = None
+        self._min_transit = None
+        self._consumed_version = 0
+        self._new_part = asyncio.Event()
+        self._future = None
+
+    async def run(self):
+        """Read the stream until cancelled, reconnecting after failures"""
+        while True:
+            writer = None
+            try:
+                reader, writer, chunked = await _connect(
+                    self.url, self.timeout, self.limit
+                )
+                await self._read_parts(reader, chunked)
+            except STREAM_ERRORS as e:
+                print(f"MJPEG stream error: {e}")
+                self.failed_reads += 1
+            finally:
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(self.retry_delay)
+
+    async def _read_parts(self, reader, chunked):
+        raw = bytearray()
+        body = bytearray()
+        while True:
+            data = await asyncio.wait_for(reader.read(self.limit), self.timeout)
+            if not data:
+                raise ConnectionError(f"MJPEG stream {self.url} ended")
+            arrival = time.time()
+            if chunked:
+                raw += data
+                _dechunk(raw, body)
+            else:
+                body += data
+
+            parts = split_parts(body)
+            if not parts:
+                continue
+            # Only the newest part that came in is worth a copy and a decode
+            for headers, _, _ in parts[:-1]:
+                self.stale_parts += 1
+                self._account(headers, arrival)
+            headers, start, end = parts[-1]
+            self._account(headers, arrival)
+            self._publish(bytes(body[start:end]), arrival)
+            del body[:end]
+
+    def _account(self, headers, arrival):
+        self.received_parts += 1
+        seq = headers.get(b"x-frame-seq")
+        if seq is not None:
+            seq = int(seq)
+            # After a server restart the numbers start over
+            if self._last_seq is not None and seq > self._last_seq:
+                self.missed_frames += seq - self._last_seq - 1
+            self._last_seq = seq
+        timestamp = headers.get(b"x-timestamp")
+        if timestamp is not None:
+            transit = arrival - float(timestamp)
+            if self._min_transit is None or transit < self._min_transit:
+                self._min_transit = transit
+            self.lag.record(transit - self._min_transit)
+
+    def _publish(self, jpeg, arrival):
+        self._frame_id += 1
+        if self.frames.version > self._consumed_version:
+            # Nobody took the previous part before this one replaced it
+            self.dropped_frames += 1
+        self.frames.put((self._frame_id, arrival, JpegFrame(jpeg)))
+        self._new_part.set()
+
+    async def parts(self):
+        """Yield the newest (frame_id, timestamp, frame) each time there is one"""
+        while True:
+            version, item = self.frames.latest()
+            if version > self._consumed_version:
+                self._consumed_version = version
+                yield item
+                continue
+            self._new_part.clear()
+            await self._new_part.wait()
+
+    def latest(self):
+        """Return the newest (frame_id, timestamp, frame) without blocking, or None"""
+        version, item = self.frames.latest()
+        self._consumed_version = version
+        return item
+
+    def next(self, timeout=5.0):
+        """Wait for a frame newer than the last one taken, returns the item or None"""
+        version, item = self.frames.get(self._consumed_version, timeout=timeout)
+        if item is not None:
+            self._consumed_version = version
+        return item
+
+    def read(self, timeout=5.0):
+        """cv2.VideoCapture style (ret, frame) on top of next()"""
+        item = self.next(timeout=timeout)
+        if item is None:
+            return False, None
+        return True, item[2]
+
+    def start(self):
+        """Run the stream on its client's event loop"""
+        self._future = asyncio.run_coroutine_threadsafe(self.run(), self.client.loop)
+        return self
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+        self.frames.close()
+
+    def release(self):
+        self.stop()
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "received_parts": self.received_parts,
+            "stale_parts": self.stale_parts,
+            "dropped_frames": self.dropped_frames,
+            "missed_frames": self.missed_frames,
+            "failed_reads": self.failed_reads,
+            "lag": self.lag.summary(),
+        }
+
+
+class MjpegClient:
+    """Any number of MjpegStreams read on one event loop in a background thread.
+
+    A reader thread per camera spends nearly all its time waiting on its
+    socket; here every stream waits in the same loop, so following many
+    Pis costs one thread. Parsing a part is cheap, decoding is left to
+    whoever takes the frame.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.streams = []
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def open(self, url, **kwargs):
+        """An MjpegStream on this client's loop, read once started"""
+        stream = MjpegStream(url, client=self, **kwargs)
+        self.streams.append(stream)
+        return stream
+
+    def stats(self):
+        return [stream.stats() for stream in self.streams]
+
+    async def _cancel_all(self):
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        for stream in self.streams:
+            stream.frames.close()
+        asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1)
+        self.loop.close()
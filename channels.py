@@ -0,0 +1,42 @@
+import threading
+
+
+class LatestChannel:
+    """Latest-wins channel between two pipeline stages.
+
+    Only the newest item is kept. A reader waits for an item newer than the
+    version it saw last, so a slow stage skips straight to the newest item
+    instead of working through a backlog, and several stages can follow the
+    same channel.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.version = 0
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            self._item = item
+            self.version += 1
+            self._cond.notify_all()
+
+    def get(self, after_version=0, timeout=None):
+        """Return (version, item) newer than after_version, item is None on timeout"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.version > after_version or self.closed, timeout
+            )
+            if self.version > after_version:
+                return self.version, self._item
+            return after_version, None
+
+    def latest(self):
+        with self._cond:
+            return self.version, self._item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
@@ -0,0 +1,110 @@
+"""Headless face recognition over HTTP, concurrent requests batched together.
+
+POST /recognize with an image body (image/jpeg, image/png) for
+    {"face_locations": [[top, right, bottom, left], ...], "names": [...],
+     "confidences": [...]}
+or with several images as multipart/form-data for {"images": [<that>, ...]},
+null for a part that is no image. ?scale=0.25 detects at that fraction of the
+posted size. A shed request gets 503 with Retry-After. GET /stats reports
+queue, batch and latency figures, POST /stats/reset starts them over.
+
+Examples:
+    python face-rec-api.py --port 8000 --max-batch 16
+    curl --data-binary @face.jpg -H "Content-Type: image/jpeg" localhost:8000/recognize
+"""
+import argparse
+
+from flask import Flask, jsonify, request
+
+from face_matcher import FaceMatcher
+from face_utils import load_know_images
+from frame_scale import FrameScale
+from recognition_service import Overloaded, RecognitionService
+
+
+def create_app(service, default_scale=1.0):
+    app = Flask(__name__)
+
+    @app.route("/recognize", methods=["POST"])
+    def recognize():
+        """Boxes, names and confidences for one posted image or a batch of them."""
+        batch = request.mimetype == "multipart/form-data"
+        images = (
+            [part.read() for part in request.files.values()]
+            if batch
+            else [request.get_data()]
+        )
+        if not images:
+            return jsonify({"error": "no image posted"}), 400
+        try:
+            frame_scale = FrameScale(request.args.get("scale", default_scale))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            results = service.recognize(images, frame_scale)
+        except Overloaded as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
+        if batch:
+            return jsonify({"images": results})
+        if results[0] is None:
+            return jsonify({"error": "not an image"}), 400
+        return jsonify(results[0])
+
+    @app.route("/stats")
+    def stats():
+        """Queue depth, shed requests, batch sizes and latencies."""
+        return jsonify(service.stats())
+
+    @app.route("/stats/reset", methods=["POST"])
+    def reset_stats():
+        """Zero the figures, so the next /stats covers only what came after."""
+        service.reset_stats()
+        return jsonify(service.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--images", default="images", help="gallery directory")
+    parser.add_argument(
+        "--max-batch", type=int, default=8, help="images per detection/encoding pass"
+    )
+    parser.add_argument(
+        "--max-wait-ms", type=float, default=10.0, help="wait for a batch to fill"
+    )
+    parser.add_argument(
+        "--max-queue", type=int, default=32, help="requests waiting before shedding"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=2.0, help="seconds a request may wait"
+    )
+    parser.add_argument("--threads", type=int, default=1, help="batcher threads")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="default detection scale"
+    )
+    parser.add_argument("--min-confidence", type=float, default=0.0)
+    args = parser.parse_args()
+
+    known_face_encodings, known_face_names = load_know_images(args.images)
+    matcher = FaceMatcher(known_face_encodings, known_face_names)
+    service = RecognitionService(
+        matcher,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+        max_queue=args.max_queue,
+        timeout=args.timeout,
+        min_confidence=args.min_confidence,
+        n_threads=args.threads,
+    ).start()
+
+    # Every request waits in its own thread, the batcher does the work
+    create_app(service, args.scale).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""Replay recorded frames through the recognition pipeline and report timings as JSON.
+
+Examples:
+    python face-rec-benchmark.py --video hallway.mp4
+    python face-rec-benchmark.py --frames recordings/ --mode pool --fps 15
+    python face-rec-benchmark.py --frames recordings/ --gallery-size 10 1000 100000 \\
+        --faces-per-frame 4 --output bench.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import face_recognition
+import multiprocessing as mp
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import time_log
+from face_detector import RoiDetector
+from face_matcher import FaceMatcher
+from face_tracker import FaceTracker
+from face_utils import (
+    detect_faces,
+    draw_processed_frame,
+    find_faces,
+    load_know_images,
+    pre_process_frame,
+)
+from frame_scale import DetectionScale
+from motion_gate import MotionGate
+from recognition_pool import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_WAIT_MS,
+    RecognitionPool,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_frames(frames_dir=None, video=None, max_frames=None):
+    """Decode the whole recording up front, keeping disk and decode time out of it"""
+    frames = []
+    if frames_dir:
+        for image in sorted(os.listdir(frames_dir)):
+            if not image.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            frames.append(cv2.imread(f"{frames_dir}/{image}"))
+            if max_frames and len(frames) >= max_frames:
+                break
+    else:
+        video_capture = cv2.VideoCapture(video)
+        while not max_frames or len(frames) < max_frames:
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            frames.append(frame)
+        video_capture.release()
+    return frames
+
+
+def build_gallery(gallery_size, images_dir=None, seed=0):
+    """Real enrolled faces if given, padded with random encodings up to gallery_size"""
+    known_face_encodings, known_face_names = [], []
+    if images_dir:
+        known_face_encodings, known_face_names = load_know_images(images_dir)
+
+    missing = max(0, gallery_size - len(known_face_encodings))
+    rng = np.random.default_rng(seed)
+    # Real encodings have entries of roughly this spread
+    synthetic = rng.normal(0.0, 0.09, size=(missing, 128))
+    known_face_encodings = list(known_face_encodings) + list(synthetic)
+    known_face_names = list(known_face_names) + [
+        f"synthetic_{i}" for i in range(missing)
+    ]
+    return known_face_encodings, known_face_names
+
+
+def synthetic_locations(rgb_small_frame, faces_per_frame):
+    """faces_per_frame boxes tiled across the frame, in detection coordinates"""
+    height, width = rgb_small_frame.shape[:2]
+    columns = int(np.ceil(np.sqrt(faces_per_frame)))
+    rows = int(np.ceil(faces_per_frame / columns))
+    box_w, box_h = width // columns, height // rows
+    return [
+        (
+            (i // columns) * box_h,
+            (i % columns + 1) * box_w - 1,
+            (i // columns + 1) * box_h - 1,
+            (i % columns) * box_w,
+        )
+        for i in range(faces_per_frame)
+    ]
+
+
+def paced(frames, fps, loops):
+    """Yield (capture timestamp, frame), sleeping to hold fps when it is set"""
+    interval = 1.0 / fps if fps else 0.0
+    next_frame = time.perf_counter()
+    for _ in range(loops):
+        for frame in frames:
+            if interval:
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_frame += interval
+            yield time.perf_counter(), frame
+
+
+def make_detector(args):
+    return RoiDetector(sweep_every=args.roi_sweep) if args.roi_sweep else None
+
+
+def make_motion_gate(args):
+    return MotionGate(max_skip=args.motion_gate) if args.motion_gate else None
+
+
+def follow_scale(scale, face_locations, tracker, detector):
+    """Let an auto scale see the detections, moving followers along on a change"""
+    factor = scale.observe(face_locations)
+    if factor is not None:
+        if tracker is not None:
+            tracker.rescale(factor)
+        if detector is not None:
+            detector.reset()
+
+
+def detect(rgb_small_frame, faces_per_frame, detector=None):
+    face_locations = detect_faces(rgb_small_frame, detector)
+    if faces_per_frame is not None:
+        face_locations = synthetic_locations(rgb_small_frame, faces_per_frame)
+    return face_locations
+
+
+def run_sequential(frames, matcher, args):
+    """pre_process_frame -> find_faces -> draw_processed_frame in one loop"""
+    tracker = FaceTracker() if args.tracker else None
+    detector = make_detector(args)
+    motion_gate = make_motion_gate(args)
+    scale = DetectionScale(args.scale)
+    end_to_end = time_log.Histogram()
+    processed = 0
+    face_locations, face_names = [], []
+    frame_scale = scale.frame_scale
+
+    for captured, frame in paced(frames, args.fps, args.loops):
+        if motion_gate is not None and not motion_gate.should_process(frame):
+            pass  # Still scene, draw the previous results
+        else:
+            frame_scale = scale.frame_scale
+            rgb_small_frame = pre_process_frame(frame, frame_scale)
+            if args.faces_per_frame is None:
+                face_locations, face_names = find_faces(
+                    matcher, rgb_small_frame, tracker, detector=detector
+                )
+            else:
+                face_locations = detect(rgb_small_frame, args.faces_per_frame, detector)
+                with time_log.timed("encode"):
+                    face_encodings = face_recognition.face_encodings(
+                        rgb_small_frame, face_locations
+                    )
+                face_names, _ = matcher.identify(face_encodings)
+            follow_scale(scale, face_locations, tracker, detector)
+
+        # Drawn on a copy, the next loop replays the same frame
+        draw_processed_frame(
+            frame.copy(),
+            face_locations,
+            face_names,
+            show_gui=False,
+            frame_scale=frame_scale,
+        )
+        end_to_end.record(time.perf_counter() - captured)
+        processed += 1
+
+    extra = {"gated_frames": motion_gate.skipped_frames if motion_gate else None}
+    return processed, 0, end_to_end, extra
+
+
+def run_pool(frames, matcher, args):
+    """pre_process_frame + detection here, encoding and matching in RecognitionPool"""
+    pool = RecognitionPool(
+        matcher,
+        n_workers=args.workers,
+        max_age=None,
+        batch_size=args.batch_size,
+        max_wait_ms=args.batch_wait_ms,
+    )
+    tracker = FaceTracker() if args.tracker else None
+    detector = make_detector(args)
+    motion_gate = make_motion_gate(args)
+    scale = DetectionScale(args.scale)
+    end_to_end = time_log.Histogram()
+    captured_at = {}
+    processed = dropped = 0
+    # Frames handed to the pool and results that came back; results dropped
+    # as stale never do, pool.stale_results counts those
+    submitted = delivered = 0
+    # Sizes of the batches the results came from, and faces encoded
+    batch_sizes = []
+    encoded_faces = 0
+
+    def collect():
+        nonlocal encoded_faces, delivered
+        for result in pool.results():
+            delivered += 1
+            end_to_end.record(time.perf_counter() - captured_at.pop(result["frame_id"]))
+            batch_sizes.append(result["batch_size"])
+            encoded_faces += len(result["names"])
+            if tracker is not None:
+                tracker.apply(
+                    result["track_ids"], result["names"], result["confidences"]
+                )
+
+    try:
+        for frame_id, (captured, frame) in enumerate(
+            paced(frames, args.fps, args.loops), 1
+        ):
+            if motion_gate is not None and not motion_gate.should_process(frame):
+                collect()
+                processed += 1
+                continue
+
+            frame_scale = scale.frame_scale
+            rgb_small_frame = pre_process_frame(frame, frame_scale)
+            face_locations = detected = detect(
+                rgb_small_frame, args.faces_per_frame, detector
+            )
+            track_ids = None
+            if tracker is not None:
+                tracks = tracker.update(face_locations)
+                due = tracker.due(tracks)
+                face_locations = [track.location for track in due]
+                track_ids = [track.track_id for track in due]
+
+            if face_locations:
+                captured_at[frame_id] = captured
+                while not pool.submit(
+                    frame_id, rgb_small_frame, face_locations, track_ids=track_ids
+                ):
+                    if args.fps:  # Real time: a busy pool means the frame is lost
+                        captured_at.pop(frame_id)
+                        dropped += 1
+                        break
+                    collect()
+                    time.sleep(0.0005)
+                if frame_id in captured_at:
+                    submitted += 1
+                    if tracker is not None:
+                        tracker.mark_pending(due)
+            follow_scale(scale, detected, tracker, detector)
+
+            draw_processed_frame(
+                frame.copy(),
+                face_locations,
+                [""] * len(face_locations),
+                show_gui=False,
+                frame_scale=frame_scale,
+            )
+            collect()
+            processed += 1
+
+        # Let the workers finish what is still in flight
+        deadline = time.perf_counter() + 5
+        while (
+            submitted > delivered + pool.stale_results
+            and time.perf_counter() < deadline
+        ):
+            collect()
+            time.sleep(0.001)
+    finally:
+        pool.close()
+
+    extra = {
+        "gated_frames": motion_gate.skipped_frames if motion_gate else None,
+        "encoded_faces": encoded_faces,
+        "mean_batch_frames": (
+            round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else None
+        ),
+    }
+    return processed, dropped + pool.stale_results, end_to_end, extra
+
+
+def resource_usage():
+    if resource is None:
+        return None
+    usage = {}
+    for who, name in (
+        (resource.RUSAGE_SELF, "self"),
+        (resource.RUSAGE_CHILDREN, "workers"),
+    ):
+        r = resource.getrusage(who)
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        usage[name] = {
+            "cpu_s": r.ru_utime + r.ru_stime,
+            "lifetime_peak_rss": r.ru_maxrss * scale,
+        }
+    return usage
+
+
+def run(frames, gallery_size, args):
+    known_face_encodings, known_face_names = build_gallery(gallery_size, args.images)
+    matcher = FaceMatcher(known_face_encodings, known_face_names)
+
+    time_log.profiler.drain()
+    before = resource_usage()
+    start = time.perf_counter()
+
+    if args.mode == "sequential":
+        processed, dropped, end_to_end, extra = run_sequential(frames, matcher, args)
+    else:
+        processed, dropped, end_to_end, extra = run_pool(frames, matcher, args)
+
+    wall = time.perf_counter() - start
+    after = resource_usage()
+
+    report = {
+        "mode": args.mode,
+        "gallery_size": len(matcher),
+        "faces_per_frame": args.faces_per_frame,
+        "roi_sweep": args.roi_sweep,
+        "scale": args.scale,
+        "workers": args.workers if args.mode == "pool" else None,
+        "batch_size": args.batch_size if args.mode == "pool" else None,
+        "target_fps": args.fps or None,
+        "frames": processed,
+        "dropped_frames": dropped,
+        "wall_s": round(wall, 3),
+        "throughput_fps": round(processed / wall, 2) if wall else 0.0,
+        **extra,
+        "end_to_end": end_to_end.summary(),
+        "stages": time_log.profiler.summary(),
+    }
+    if extra.get("encoded_faces") is not None:
+        report["encodings_per_s"] = round(extra["encoded_faces"] / wall, 1)
+    if before and after:
+        cpu = sum(after[k]["cpu_s"] - before[k]["cpu_s"] for k in after)
+        report["cpu_s"] = round(cpu, 3)
+        report["cpu_utilization"] = round(cpu / wall, 3) if wall else 0.0
+        # The peak since the benchmark started, not of this run; later runs
+        # show an earlier run's peak unless they use more
+        report["lifetime_peak_rss"] = {k: after[k]["lifetime_peak_rss"] for k in after}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--frames", help="directory of images, replayed in name order")
+    source.add_argument("--video", help="video file to replay")
+    parser.add_argument("--mode", choices=("sequential", "pool"), default="sequential")
+    parser.add_argument("--workers", type=int, default=None, help="pool workers")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="faces a pool worker encodes in one pass, 1 disables batching",
+    )
+    parser.add_argument(
+        "--batch-wait-ms",
+        type=float,
+        default=DEFAULT_BATCH_WAIT_MS,
+        help="how long a pool worker waits for a batch to fill",
+    )
+    parser.add_argument(
+        "--fps", type=float, default=0, help="replay rate, 0 is as fast as possible"
+    )
+    parser.add_argument("--loops", type=int, default=1, help="replay N times")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument(
+        "--gallery-size",
+        type=int,
+        nargs="+",
+        default=[10],
+        help="one run per size, padded with synthetic encodings",
+    )
+    parser.add_argument("--images", default=None, help="real gallery to start from")
+    parser.add_argument(
+        "--faces-per-frame",
+        type=int,
+        default=None,
+        help="encode this many synthetic boxes per frame instead of the detections",
+    )
+    parser.add_argument("--tracker", action="store_true", help="skip tracked faces")
+    parser.add_argument(
+        "--roi-sweep",
+        type=int,
+        default=None,
+        help="detect around the last faces, searching the whole frame every N",
+    )
+    parser.add_argument(
+        "--scale",
+        default="0.25",
+        help="detection scale, a fraction or auto",
+    )
+    parser.add_argument(
+        "--motion-gate",
+        type=int,
+        default=None,
+        metavar="MAX_SKIP",
+        help="skip detection on still frames, at most MAX_SKIP in a row",
+    )
+    parser.add_argument("--output", default=None, help="write JSON here, not stdout")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, args.video, args.max_frames)
+    if not frames:
+        parser.error("no frames to replay")
+
+    # Spawned workers read the switch from the environment
+    os.environ["FACE_PROFILE"] = "on"
+    time_log.enable()
+    reports = [run(frames, size, args) for size in args.gallery_size]
+    output = json.dumps(reports if len(reports) > 1 else reports[0], indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    main()
@@ -0,0 +1,153 @@
+"""Load the recognition API with concurrent clients and report throughput as JSON.
+
+Examples:
+    python face-rec-loadgen.py --images recordings/ --concurrency 1 4 16
+    python face-rec-loadgen.py --images recordings/ --batch 4 --duration 30 \\
+        --url http://localhost:8000/recognize --output load.json
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+import requests
+
+import time_log
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_images(images_dir):
+    images = []
+    for image in sorted(os.listdir(images_dir)):
+        if image.lower().endswith(IMAGE_EXTENSIONS):
+            with open(f"{images_dir}/{image}", "rb") as f:
+                images.append((image, f.read()))
+    return images
+
+
+def post(session, url, images):
+    """One request, a single image body or a multipart batch"""
+    if len(images) == 1:
+        name, data = images[0]
+        content_type = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+        return session.post(
+            url, data=data, headers={"Content-Type": content_type}, timeout=30
+        )
+    files = {f"image{i}": (name, data) for i, (name, data) in enumerate(images)}
+    return session.post(url, files=files, timeout=30)
+
+
+def run(url, images, concurrency, duration, batch):
+    """concurrency clients posting back to back for duration seconds"""
+    latency = time_log.Histogram()
+    counts = {"ok": 0, "shed": 0, "failed": 0, "images": 0, "faces": 0}
+    lock = threading.Lock()
+    # Every client walks the recording from a different place
+    cursor = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        backoff = 0.0
+        while time.perf_counter() < deadline:
+            start = next(cursor) * batch
+            chunk = [images[(start + i) % len(images)] for i in range(batch)]
+            sent = time.perf_counter()
+            try:
+                response = post(session, url, chunk)
+            except requests.exceptions.RequestException:
+                with lock:
+                    counts["failed"] += 1
+                # The service is down or unreachable, do not hammer it
+                backoff = min(max(2 * backoff, 0.1), 2.0)
+                time.sleep(min(backoff, max(deadline - time.perf_counter(), 0)))
+                continue
+            backoff = 0.0
+            elapsed = time.perf_counter() - sent
+            with lock:
+                if response.status_code == 503:
+                    counts["shed"] += 1
+                elif response.ok:
+                    counts["ok"] += 1
+                    counts["images"] += len(chunk)
+                    body = response.json()
+                    for result in body["images"] if batch > 1 else [body]:
+                        counts["faces"] += len((result or {}).get("names", []))
+                    latency.record(elapsed)
+                else:
+                    counts["failed"] += 1
+        session.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    requests_sent = counts["ok"] + counts["shed"] + counts["failed"]
+    return {
+        "concurrency": concurrency,
+        "batch": batch,
+        "wall_s": round(wall, 3),
+        "requests": requests_sent,
+        **counts,
+        "shed_rate": round(counts["shed"] / requests_sent, 3) if requests_sent else 0,
+        "requests_per_s": round(counts["ok"] / wall, 2),
+        "images_per_s": round(counts["images"] / wall, 2),
+        "latency": latency.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000/recognize")
+    parser.add_argument("--images", required=True, help="directory of images to post")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="one run per number of concurrent clients",
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--batch", type=int, default=1, help="images per request")
+    parser.add_argument("--output", default=None, help="write JSON here, not stdout")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        parser.error("no images to post")
+
+    stats_url = args.url.rsplit("/", 1)[0] + "/stats"
+    reports = []
+    for concurrency in args.concurrency:
+        # The service counts from its start, zero it so figures are per run
+        try:
+            requests.post(stats_url + "/reset", timeout=5).raise_for_status()
+            reset = True
+        except requests.exceptions.RequestException:
+            reset = False
+        report = run(args.url, images, concurrency, args.duration, args.batch)
+        # What the service saw, e.g. how well requests were batched
+        try:
+            report["service"] = requests.get(stats_url, timeout=5).json()
+            report["service"]["per_run"] = reset
+        except (requests.exceptions.RequestException, ValueError):
+            report["service"] = None
+        reports.append(report)
+    output = json.dumps(reports if len(reports) > 1 else reports[0], indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,32 @@
 import cv2
 import face_recognition
 import multiprocessing as mp
-from multiprocessing import shared_memory
-import numpy as np
 import os
+import threading
 from datetime import datetime
 import uuid
 
+from face_detector import RoiDetector
+from face_matcher import FaceMatcher
 from face_utils import (
-    draw_processed_frame,
-    find_faces,
+    add_to_encoding_cache,
     load_know_images,
     pre_process_frame,
 )
+from motion_gate import MotionGate
+from pipeline import FacePipeline
+from time_log import timed
 
 
-def save_face_image(frame, face_location):
+def save_face_image(frame, face_location, frame_scale):
     """Save detected face with random ID"""
     # Create images directory if it doesn't exist
     if not os.path.exists("images"):
         os.makedirs("images")
 
     # Extract face from frame
-    top, right, bottom, left = face_location
     # Scale back up face locations
-    scale = 4
-    top *= scale
-    right *= scale
-    bottom *= scale
-    left *= scale
+    top, right, bottom, left = frame_scale.to_frame(face_location)
 
     face_image = frame[top:bottom, left:right]
 
@@ -41,68 +39,6 @@ def save_face_image(frame, face_location):
     return filename
 
 
-def process_faces(frame_queue, result_queue, known_face_encodings, known_face_names):
-    """Process function that runs in a separate process"""
-    while True:
-        try:
-            # Get frame data from queue
-            frame_data = frame_queue.get()
-            if frame_data is None:  # Poison pill for clean shutdown
-                break
-
-            # Process faces
-            face_locations = np.array(frame_data["face_locations"])
-
-            face_encodings = face_recognition.face_encodings(
-                frame_data["rgb_small_frame"], frame_data["face_locations"]
-            )
-
-            local_face_names = []
-            face_confidences = []
-            unknown_encodings = []
-
-            # Process each detected face
-            for face_encoding in face_encodings:
-                matches = face_recognition.compare_faces(
-                    known_face_encodings, face_encoding, tolerance=0.6
-                )
-                name = "Unknown"
-                confidence = 0.0
-
-                if True in matches:
-                    face_distances = face_recognition.face_distance(
-                        known_face_encodings, face_encoding
-                    )
-                    best_match_index = np.argmin(face_distances)
-
-                    if matches[best_match_index]:
-                        confidence = 1 - face_distances[best_match_index]
-                        if confidence > 0.5:
-                            name = known_face_names[best_match_index]
-
-                if name == "Unknown":
-                    unknown_encodings.append(face_encoding)
-
-                local_face_names.append(name)
-                face_confidences.append(confidence)
-
-            print(
-                f"Found {len(local_face_names)} faces: {list(zip(local_face_names, face_confidences))}"
-            )
-
-            result_queue.put(
-                {
-                    "names": local_face_names,
-                    "confidences": face_confidences,
-                    "unknown_encodings": unknown_encodings,
-                }
-            )
-
-        except Exception as e:
-            print(f"Error in process_faces: {e}")
-            continue
-
-
 def main():
     # Initialize video capture
     video_capture = cv2.VideoCapture(0)
@@ -112,103 +48,89 @@ def main():
 
     # Load known faces
     known_face_encodings, known_face_names = load_know_images()
+    matcher = FaceMatcher(known_face_encodings, known_face_names, tolerance=0.6)
+
+    unknown_seen = threading.Event()
+    # Encodings of the unknown faces on screen by track ID, enrolled on save
+    unknown_encodings = {}
+
+    def on_result(result):
+        # Runs in the detection thread, the render loop does the pausing
+        unknown_track_ids = [
+            track_id
+            for track_id, name in zip(result["track_ids"], result["names"])
+            if name == "Unknown"
+        ]
+        unknown_encodings.update(zip(unknown_track_ids, result["unknown_encodings"]))
+        for track_id in list(unknown_encodings):
+            if track_id not in pipeline.tracker.tracks:
+                # The render loop may have popped it for a save meanwhile
+                unknown_encodings.pop(track_id, None)
+        if unknown_track_ids:
+            unknown_seen.set()
+
+    pipeline = FacePipeline(
+        video_capture,
+        matcher,
+        min_confidence=0.5,
+        on_result=on_result,
+        detector=RoiDetector(),
+        motion_gate=MotionGate(),
+    ).start()
 
-    frame_queue = mp.Queue(maxsize=2)
-    result_queue = mp.Queue()
-
-    face_process = mp.Process(
-        target=process_faces,
-        args=(frame_queue, result_queue, known_face_encodings, known_face_names),
-    )
-    face_process.daemon = True
-    face_process.start()
-
-    face_locations = []
-    face_names = []
-    face_confidences = []
-    process_this_frame = True
     paused = False
     current_frame = None
 
     try:
         while True:
             if not paused:
-                ret, frame = video_capture.read()
-                if not ret:
+                frame, detection = pipeline.next_frame()
+                if frame is None:
                     continue
-                current_frame = frame.copy()
-            else:
-                frame = current_frame.copy()
-
-            if process_this_frame and not paused:
-                rgb_small_frame = pre_process_frame(frame)
-
-                face_locations = face_recognition.face_locations(
-                    rgb_small_frame, model="hog"
-                )
 
-                if face_locations:
-                    try:
-                        frame_queue.put_nowait(
-                            {
-                                "face_locations": face_locations,
-                                "rgb_small_frame": rgb_small_frame,
-                            }
-                        )
-                        face_names = ["Detecting..."] * len(face_locations)
-                        face_confidences = [0.0] * len(face_locations)
-                    except mp.queues.Full:
-                        pass
-                else:
-                    face_names = []
-                    face_confidences = []
-
-            process_this_frame = not process_this_frame
+                # If we found an unknown face, pause on the frame it was found in
+                if unknown_seen.is_set() and "Unknown" in detection["names"]:
+                    unknown_seen.clear()
+                    paused = True
+                    current_frame = detection["frame"]
+                    print("\nUnknown face detected! Press 's' to save or Enter to skip")
 
-            # Check for results
-            try:
-                while True:
-                    result = result_queue.get_nowait()
-                    face_names = result["names"]
-                    face_confidences = result["confidences"]
-
-                    # If we found an unknown face, pause the video
-                    if "Unknown" in face_names and not paused:
-                        paused = True
-                        print(
-                            "\nUnknown face detected! Press 's' to save or Enter to skip"
-                        )
+            if paused:
+                frame = current_frame.copy()
 
-            except mp.queues.Empty:
-                pass
+            face_locations = detection["face_locations"]
+            frame_scale = detection["frame_scale"]
+            face_names = detection["names"]
+            face_confidences = detection["confidences"]
 
             # Draw the results
-            frame_copy = frame.copy()
-            for (top, right, bottom, left), name, confidence in zip(
-                face_locations, face_names, face_confidences
-            ):
-                scale = 4
-                top *= scale
-                right *= scale
-                bottom *= scale
-                left *= scale
-
-                color = (0, 0, 255) if name == "Unknown" else (0, 255, 0)
-                cv2.rectangle(frame_copy, (left, top), (right, bottom), color, 2)
-                cv2.rectangle(
-                    frame_copy, (left, bottom - 35), (right, bottom), color, cv2.FILLED
-                )
-                font = cv2.FONT_HERSHEY_DUPLEX
-                conf_text = f"{confidence:.2f}" if confidence > 0 else ""
-                cv2.putText(
-                    frame_copy,
-                    f"{name} {conf_text}",
-                    (left + 6, bottom - 6),
-                    font,
-                    0.6,
-                    (255, 255, 255),
-                    1,
-                )
+            with timed("draw"):
+                frame_copy = frame.copy()
+                for location, name, confidence in zip(
+                    face_locations, face_names, face_confidences
+                ):
+                    top, right, bottom, left = frame_scale.to_frame(location)
+
+                    color = (0, 0, 255) if name == "Unknown" else (0, 255, 0)
+                    cv2.rectangle(frame_copy, (left, top), (right, bottom), color, 2)
+                    cv2.rectangle(
+                        frame_copy,
+                        (left, bottom - 35),
+                        (right, bottom),
+                        color,
+                        cv2.FILLED,
+                    )
+                    font = cv2.FONT_HERSHEY_DUPLEX
+                    conf_text = f"{confidence:.2f}" if confidence > 0 else ""
+                    cv2.putText(
+                        frame_copy,
+                        f"{name} {conf_text}",
+                        (left + 6, bottom - 6),
+                        font,
+                        0.6,
+                        (255, 255, 255),
+                        1,
+                    )
 
             # Display the resulting frame
             cv2.imshow("Video", frame_copy)
@@ -222,28 +144,25 @@ def main():
                     print("Skipped")
                 elif key == ord("s"):  # 's' key to save
                     # Find the index of the unknown face
-                    unknown_idx = face_names.index("Unknown")
-                    if unknown_idx >= 0:
+                    if "Unknown" in face_names:
+                        unknown_idx = face_names.index("Unknown")
                         # Save the face image
-                        filename = save_face_image(frame, face_locations[unknown_idx])
-                        print(f"Saved face as {filename}")
-                        # Reload known faces
-                        known_face_encodings, known_face_names = load_know_images()
-                        # Update the face process with new encodings
-                        frame_queue.put(None)  # Stop the old process
-                        face_process.join(timeout=1)
-                        # Start new process with updated encodings
-                        face_process = mp.Process(
-                            target=process_faces,
-                            args=(
-                                frame_queue,
-                                result_queue,
-                                known_face_encodings,
-                                known_face_names,
-                            ),
+                        filename = save_face_image(
+                            frame, face_locations[unknown_idx], frame_scale
                         )
-                        face_process.daemon = True
-                        face_process.start()
+                        print(f"Saved face as {filename}")
+                        track = detection["tracks"][unknown_idx]
+                        encoding = unknown_encodings.pop(track.track_id, None)
+                        if encoding is None:
+                            # Result pruned, encode the face of the paused frame
+                            encoding = face_recognition.face_encodings(
+                                pre_process_frame(current_frame, frame_scale),
+                                [face_locations[unknown_idx]],
+                            )[0]
+                        name = os.path.basename(filename).split(".")[0]
+                        # Enroll in the running workers, no reload or restart
+                        pipeline.add_identity(name, encoding, track.track_id)
+                        add_to_encoding_cache(filename, encoding)
                     paused = False
 
             if key == ord("q"):
@@ -251,10 +170,7 @@ def main():
 
     finally:
         # Cleanup
-        frame_queue.put(None)
-        face_process.join(timeout=1)
-        if face_process.is_alive():
-            face_process.terminate()
+        pipeline.stop()
         video_capture.release()
         cv2.destroyAllWindows()
 
@@ -0,0 +1,105 @@
+"""Recognize faces on several cameras in one process with one gallery and pool.
+
+Examples:
+    python face-rec-multicam.py 0 1
+    python face-rec-multicam.py front=http://192.168.76.120:5000/video_feed \\
+        back=http://192.168.76.121:5000/video_feed --workers 4 --report-every 5
+"""
+import argparse
+import json
+import time
+
+import cv2
+import multiprocessing as mp
+
+from face_matcher import FaceMatcher
+from face_utils import draw_processed_frame, load_know_images
+from frame_scale import DEFAULT_SCALE
+from multi_camera import MultiCameraServer
+
+
+def parse_sources(sources):
+    """NAME=SOURCE or just SOURCE, named after its position"""
+    parsed = {}
+    for i, source in enumerate(sources):
+        name, sep, value = source.partition("=")
+        if not sep or name.isdigit() or "://" in name:
+            name, value = f"camera{i}", source
+        parsed[name] = value
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help="camera index, Pi /video_feed URL or video file, optionally NAME=SOURCE",
+    )
+    parser.add_argument("--images", default="images", help="gallery directory")
+    parser.add_argument("--workers", type=int, default=None, help="pool workers")
+    parser.add_argument(
+        "--detect-threads", type=int, default=1, help="threads running detection"
+    )
+    parser.add_argument("--scale", default=DEFAULT_SCALE, help="fraction or auto")
+    parser.add_argument("--min-confidence", type=float, default=0.0)
+    parser.add_argument(
+        "--report-every", type=float, default=10.0, help="seconds, 0 disables"
+    )
+    parser.add_argument("--show", action="store_true", help="one window per camera")
+    args = parser.parse_args()
+
+    # Load known faces once for every camera
+    known_face_encodings, known_face_names = load_know_images(args.images)
+    matcher = FaceMatcher(known_face_encodings, known_face_names)
+
+    server = MultiCameraServer(
+        parse_sources(args.sources),
+        matcher,
+        n_workers=args.workers,
+        detect_threads=args.detect_threads,
+        min_confidence=args.min_confidence,
+        scale=args.scale,
+        report_every=args.report_every,
+    ).start()
+
+    versions = {camera.name: 0 for camera in server.cameras}
+    try:
+        while not args.show:
+            # Headless, the report thread prints per-camera stats
+            time.sleep(1)
+
+        while True:
+            for camera in server.cameras:
+                version, detection = camera.detections.get(
+                    versions[camera.name], timeout=0.01
+                )
+                if detection is None:
+                    continue
+                versions[camera.name] = version
+                frame = detection["frame"]
+                frame = frame.full().copy() if hasattr(frame, "full") else frame.copy()
+                draw_processed_frame(
+                    frame,
+                    detection["face_locations"],
+                    detection["names"],
+                    show_gui=False,
+                    frame_scale=detection["frame_scale"],
+                )
+                cv2.imshow(camera.name, frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.report(), indent=2))
+        server.stop()
+        if args.show:
+            cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    # This is required for Windows support
+    mp.freeze_support()
+    main()
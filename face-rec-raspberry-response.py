@@ -1,16 +1,42 @@
+import json
+import time
+
 import cv2
 import face_recognition
-import numpy as np
-import requests  # Add this for sending frames to Raspberry Pi
+
+from async_mjpeg import MjpegClient
+from face_detector import RoiDetector
+from face_matcher import FaceMatcher
+from face_tracker import FaceTracker
+from face_utils import find_faces
+from frame_scale import DetectionScale
+from frame_scheduler import AdaptiveScheduler
+from frame_uploader import FrameUploader
+from motion_gate import MotionGate
+import time_log
+from time_log import timed
 
 # Replace with the IP address of your Raspberry Pi
 raspberry_pi_ip = (
     "192.168.76.120"  # Replace with your Raspberry Pi's actual IP address
 )
 video_stream_url = f"http://{raspberry_pi_ip}:5000/video_feed"
-processed_frame_url = f"http://{raspberry_pi_ip}:5000/processed_frame"
-
-video_capture = cv2.VideoCapture(video_stream_url)
+processed_stream_url = f"http://{raspberry_pi_ip}:5000/processed_stream"
+# Send only boxes and names and let the Pi draw them onto its own frames,
+# instead of drawing here and sending every frame back as a JPEG
+send_metadata = True
+
+# Read the video stream from Raspberry Pi in the background so recognition
+# always runs on the newest frame instead of a growing backlog. Parts we fall
+# behind on are dropped undecoded, the rest stay JPEGs until used: detection
+# decodes them straight to the detection scale
+mjpeg_client = MjpegClient()
+video_capture = mjpeg_client.open(video_stream_url).start()
+# Processed frames go back over one persistent upload, sent in the background
+uploader = FrameUploader(
+    processed_stream_url,
+    content_type="application/json" if send_metadata else "image/jpeg",
+).start()
 
 obama_image = face_recognition.load_image_file("images/Erfan.jpg")
 obama_face_encoding = face_recognition.face_encodings(obama_image)[0]
@@ -26,68 +52,88 @@ known_face_names = [
     "Erfan",
     "Alireza",
 ]
+matcher = FaceMatcher(known_face_encodings, known_face_names)
+tracker = FaceTracker()
+# Searches around the last faces found, and the whole frame every 10 detections
+detector = RoiDetector(sweep_every=10)
+# Skips detection while the scene is still, judged on a 1/8 size decode
+motion_gate = MotionGate()
+# FACE_DETECTION_SCALE picks the detection scale, e.g. 0.5 for a distant
+# camera, 0.125 for a close-up one or auto
+scale = DetectionScale()
+frame_scale = scale.frame_scale
 
 face_locations = []
-face_encodings = []
 face_names = []
-process_this_frame = True
+face_confidences = []
+# Decides from measured load which frames get detection and recognition
+scheduler = AdaptiveScheduler()
 
 while True:
-    ret, frame = video_capture.read()
-    if not ret:
+    item = video_capture.next()
+    if item is None:
         print("Failed to capture frame.")
         break
+    frame_id, _, jpeg_frame = item
 
-    if process_this_frame:
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        rgb_small_frame = small_frame[:, :, ::-1]
+    if scheduler.should_process() and motion_gate.should_process(
+        jpeg_frame.small(8)
+    ):
+        start = time.perf_counter()
+        frame_scale = scale.frame_scale
+        rgb_small_frame = jpeg_frame.rgb_small(frame_scale)
 
-        face_locations = face_recognition.face_locations(rgb_small_frame)
-        face_encodings = face_recognition.face_encodings(
-            rgb_small_frame, face_locations
+        face_locations, face_names, face_confidences = find_faces(
+            matcher, rgb_small_frame, tracker, with_confidences=True, detector=detector
+        )
+        factor = scale.observe(face_locations)
+        if factor is not None:
+            tracker.rescale(factor)
+            detector.reset()
+        scheduler.record_processing(time.perf_counter() - start)
+
+    if send_metadata:
+        # A few hundred bytes instead of a whole JPEG per frame, and the full
+        # frame is never decoded
+        uploader.send(
+            json.dumps(
+                {
+                    "frame_id": frame_id,
+                    "frame_size": [jpeg_frame.shape[1], jpeg_frame.shape[0]],
+                    "face_locations": [
+                        frame_scale.to_frame(location) for location in face_locations
+                    ],
+                    "names": face_names,
+                    "confidences": face_confidences,
+                }
+            ).encode()
         )
+        scheduler.frame_done()
+        continue
 
-        face_names = []
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(
-                known_face_encodings, face_encoding
-            )
-            name = "Unknown"
+    frame = jpeg_frame.full()
+    with timed("draw"):
+        for location, name in zip(face_locations, face_names):
+            top, right, bottom, left = frame_scale.to_frame(location)
 
-            face_distances = face_recognition.face_distance(
-                known_face_encodings, face_encoding
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+            cv2.rectangle(
+                frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED
+            )
+            font = cv2.FONT_HERSHEY_DUPLEX
+            cv2.putText(
+                frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1
             )
-            best_match_index = np.argmin(face_distances)
-            if matches[best_match_index]:
-                name = known_face_names[best_match_index]
-
-            face_names.append(name)
-
-    process_this_frame = not process_this_frame
-
-    for (top, right, bottom, left), name in zip(face_locations, face_names):
-        top *= 4
-        right *= 4
-        bottom *= 4
-        left *= 4
-
-        cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-        cv2.rectangle(
-            frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED
-        )
-        font = cv2.FONT_HERSHEY_DUPLEX
-        cv2.putText(frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1)
 
     # Send processed frame to Raspberry Pi
-    _, buffer = cv2.imencode(".jpg", frame)
-    frame_bytes = buffer.tobytes()
-    try:
-        requests.post(
-            processed_frame_url,
-            data=frame_bytes,
-            headers={"Content-Type": "image/jpeg"},
-        )
-    except requests.exceptions.RequestException as e:
-        print("Failed to send frame to Raspberry Pi:", e)
+    with timed("jpeg_encode"):
+        _, buffer = cv2.imencode(".jpg", frame)
+        frame_bytes = buffer.tobytes()
+    uploader.send(frame_bytes)
+
+    scheduler.frame_done()
 
-video_capture.release()
+if time_log.enabled:
+    print(time_log.profiler.report())
+uploader.stop()
+mjpeg_client.close()
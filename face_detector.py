@@ -0,0 +1,112 @@
+import face_recognition
+
+from time_log import timed
+
+
+def _expand(location, margin, height, width):
+    """Grow a (top, right, bottom, left) box by margin of its size, inside the frame"""
+    top, right, bottom, left = location
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    return (
+        max(0, top - pad_y),
+        min(width, right + pad_x),
+        min(height, bottom + pad_y),
+        max(0, left - pad_x),
+    )
+
+
+def _merge(regions):
+    """Union overlapping regions so no face is searched for, or found, twice"""
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[3] < b[1] and b[3] < a[1]:
+                    regions[i] = (
+                        min(a[0], b[0]),
+                        max(a[1], b[1]),
+                        max(a[2], b[2]),
+                        min(a[3], b[3]),
+                    )
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+class RoiDetector:
+    """Run HOG only around the faces found in the previous detection.
+
+    Each previous face location is grown by margin of its size on every side
+    and only those regions are searched, so detection cost follows the area
+    of the faces instead of the whole frame. Every sweep_every detections,
+    whenever there is nothing to follow and right after a followed face was
+    lost, the whole frame is searched instead to pick up newcomers.
+
+    Locations are returned in the coordinates of the frame passed to
+    detect(), exactly like face_recognition.face_locations().
+    """
+
+    def __init__(self, sweep_every=10, margin=0.5, number_of_times_to_upsample=1):
+        self.sweep_every = sweep_every
+        self.margin = margin
+        self.number_of_times_to_upsample = number_of_times_to_upsample
+        self.face_locations = []
+        self.sweeps = 0
+        self.roi_detections = 0
+        # Share of the frame the last detection searched, 1.0 on a sweep
+        self.searched_fraction = 1.0
+        self._since_sweep = 0
+        self._sweep_due = True
+
+    def detect(self, rgb_small_frame):
+        height, width = rgb_small_frame.shape[:2]
+        self._since_sweep += 1
+        if (
+            self._sweep_due
+            or not self.face_locations
+            or self._since_sweep >= self.sweep_every
+        ):
+            with timed("detect_sweep"):
+                face_locations = face_recognition.face_locations(
+                    rgb_small_frame, self.number_of_times_to_upsample
+                )
+            self.sweeps += 1
+            self.searched_fraction = 1.0
+            self._since_sweep = 0
+            self._sweep_due = False
+        else:
+            regions = _merge(
+                _expand(location, self.margin, height, width)
+                for location in self.face_locations
+            )
+            face_locations = []
+            with timed("detect_roi"):
+                for top, right, bottom, left in regions:
+                    found = face_recognition.face_locations(
+                        rgb_small_frame[top:bottom, left:right],
+                        self.number_of_times_to_upsample,
+                    )
+                    # Back into frame coordinates
+                    face_locations.extend(
+                        (t + top, r + left, b + top, l + left) for t, r, b, l in found
+                    )
+            self.roi_detections += 1
+            self.searched_fraction = sum(
+                (bottom - top) * (right - left) for top, right, bottom, left in regions
+            ) / float(height * width)
+            # A face moved out of its region or left, look everywhere next time
+            self._sweep_due = len(face_locations) < len(self.face_locations)
+
+        self.face_locations = face_locations
+        return face_locations
+
+    def reset(self):
+        """Search the whole frame next time, e.g. after a scene cut or camera switch"""
+        self._sweep_due = True
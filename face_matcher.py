@@ -0,0 +1,119 @@
+import numpy as np
+
+from ann_index import IVFIndex
+from time_log import profiled
+
+# Galleries at least this large get an IVF index instead of a linear scan
+ANN_MIN_GALLERY_SIZE = 10000
+
+
+class FaceMatcher:
+    """Match face encodings against the known gallery in one shot.
+
+    The gallery is kept as a single contiguous float32 matrix with its squared
+    norms precomputed, so matching every face of a frame is one matrix product
+    instead of a compare_faces + face_distance pair per face.
+
+    Large galleries are searched through an IVFIndex instead. Pass an index
+    built or loaded up front to reuse it, or index=False to always scan.
+    """
+
+    def __init__(
+        self, known_face_encodings, known_face_names, tolerance=0.6, index=None
+    ):
+        self.tolerance = tolerance
+        self.known_face_names = list(known_face_names)
+        self.known_face_encodings = np.ascontiguousarray(
+            np.asarray(known_face_encodings, dtype=np.float32).reshape(-1, 128)
+        )
+        self.known_norms = np.einsum(
+            "ij,ij->i", self.known_face_encodings, self.known_face_encodings
+        )
+
+        if index is None and len(self) >= ANN_MIN_GALLERY_SIZE:
+            index = IVFIndex.build(self.known_face_encodings)
+        self.index = index if index is not False else None
+
+    def __len__(self):
+        return len(self.known_face_names)
+
+    def add(self, name, encoding):
+        """Enroll one more face, e.g. an unknown encoding returned by a worker"""
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(1, 128)
+        if self.index is not None:
+            self.index.add(encoding, [len(self)])
+        self.known_face_encodings = np.vstack([self.known_face_encodings, encoding])
+        self.known_norms = np.append(
+            self.known_norms, np.einsum("ij,ij->i", encoding, encoding)
+        )
+        self.known_face_names.append(name)
+
+    def remove(self, name):
+        """Drop every face enrolled under name, returns how many there were"""
+        rows = [i for i, known in enumerate(self.known_face_names) if known == name]
+        if rows:
+            if self.index is not None:
+                self.index.remove(rows)
+            self.known_face_encodings = np.delete(
+                self.known_face_encodings, rows, axis=0
+            )
+            self.known_norms = np.delete(self.known_norms, rows)
+            self.known_face_names = [
+                known for known in self.known_face_names if known != name
+            ]
+        return len(rows)
+
+    def rename(self, name, new_name):
+        """Relabel every face enrolled under name, returns how many there were"""
+        count = 0
+        for i, known in enumerate(self.known_face_names):
+            if known == name:
+                self.known_face_names[i] = new_name
+                count += 1
+        return count
+
+    @profiled("match")
+    def match(self, face_encodings):
+        """Return (best_indices, distances, confidences), one entry per face.
+
+        Distances are the same euclidean distances face_recognition.face_distance
+        returns and confidence is 1 - distance. With an empty gallery every
+        index is -1 and every distance is inf.
+        """
+        faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        if not len(faces) or not len(self):
+            best_indices = np.full(len(faces), -1, dtype=np.int64)
+            distances = np.full(len(faces), np.inf, dtype=np.float32)
+            return best_indices, distances, np.zeros(len(faces), dtype=np.float32)
+
+        if self.index is not None:
+            ids, distances = self.index.search(faces, k=1)
+            return ids[:, 0], distances[:, 0], 1 - distances[:, 0]
+
+        face_norms = np.einsum("ij,ij->i", faces, faces)
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b for the whole faces x gallery matrix
+        squared = faces @ self.known_face_encodings.T
+        squared *= -2
+        squared += face_norms[:, None]
+        squared += self.known_norms[None, :]
+
+        best_indices = np.argmin(squared, axis=1)
+        best = squared[np.arange(len(faces)), best_indices]
+        distances = np.sqrt(np.maximum(best, 0))
+        return best_indices, distances, 1 - distances
+
+    def identify(self, face_encodings, min_confidence=0.0):
+        """Return (names, confidences) using the closest known face within tolerance"""
+        best_indices, distances, confidences = self.match(face_encodings)
+
+        face_names = []
+        face_confidences = []
+        for index, distance, confidence in zip(best_indices, distances, confidences):
+            within = index >= 0 and distance <= self.tolerance
+            if within and confidence > min_confidence:
+                face_names.append(self.known_face_names[index])
+                face_confidences.append(float(confidence))
+            else:
+                face_names.append("Unknown")
+                face_confidences.append(0.0)
+        return face_names, face_confidences
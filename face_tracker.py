@@ -0,0 +1,144 @@
+import itertools
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    if not intersection:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return intersection / float(area_a + area_b - intersection)
+
+
+class Track:
+    def __init__(self, track_id, location, frame):
+        self.track_id = track_id
+        self.location = location
+        self.last_seen = frame
+        self.name = None
+        self.confidence = 0.0
+        self.recognized_at = None
+        self.pending_since = None
+
+    @property
+    def label(self):
+        return self.name if self.name is not None else "Checking..."
+
+
+class FaceTracker:
+    """Keep identities attached to faces between recognitions.
+
+    Detections are associated to existing tracks by greedy IoU matching, so a
+    face that stays on screen keeps its track ID and label. Only new tracks
+    and tracks whose last recognition is older than reverify_every frames
+    are reported as due for encoding and matching.
+    """
+
+    def __init__(
+        self, iou_threshold=0.3, max_missing=5, reverify_every=30, pending_timeout=15
+    ):
+        self.iou_threshold = iou_threshold
+        self.max_missing = max_missing
+        self.reverify_every = reverify_every
+        # A job lost to a full or stale queue must not block its track forever
+        self.pending_timeout = pending_timeout
+        self.frame = 0
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+    def update(self, face_locations):
+        """Associate this frame's detections, returns one Track per location"""
+        self.frame += 1
+        tracks = list(self.tracks.values())
+
+        pairs = sorted(
+            (
+                (iou(track.location, location), t, d)
+                for t, track in enumerate(tracks)
+                for d, location in enumerate(face_locations)
+            ),
+            reverse=True,
+        )
+        assigned = [None] * len(face_locations)
+        used_tracks = set()
+        for overlap, t, d in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in used_tracks or assigned[d] is not None:
+                continue
+            used_tracks.add(t)
+            assigned[d] = tracks[t]
+
+        for d, location in enumerate(face_locations):
+            track = assigned[d]
+            if track is None:
+                track = Track(next(self._ids), location, self.frame)
+                self.tracks[track.track_id] = track
+                assigned[d] = track
+            track.location = location
+            track.last_seen = self.frame
+
+        for track_id, track in list(self.tracks.items()):
+            if self.frame - track.last_seen > self.max_missing:
+                del self.tracks[track_id]
+
+        return assigned
+
+    def due(self, tracks):
+        """Return the tracks that need to be (re)recognized now"""
+        due = []
+        for track in tracks:
+            if track.pending_since is not None:
+                if self.frame - track.pending_since < self.pending_timeout:
+                    continue
+            if (
+                track.recognized_at is None
+                or self.frame - track.recognized_at >= self.reverify_every
+            ):
+                due.append(track)
+        return due
+
+    def mark_pending(self, tracks):
+        for track in tracks:
+            track.pending_since = self.frame
+
+    def apply(self, track_ids, names, confidences):
+        """Attach recognition results to the tracks they were computed for"""
+        for track_id, name, confidence in zip(track_ids, names, confidences):
+            track = self.tracks.get(track_id)
+            if track is None:  # Left the frame while being recognized
+                continue
+            track.name = name
+            track.confidence = confidence
+            track.recognized_at = self.frame
+            track.pending_since = None
+
+    def retry(self, track_ids):
+        """Make tracks whose result was thrown away due again"""
+        for track_id in track_ids:
+            track = self.tracks.get(track_id)
+            if track is not None:
+                track.pending_since = None
+
+    def rescale(self, factor):
+        """Move every track to detection coordinates scaled by factor"""
+        for track in self.tracks.values():
+            track.location = tuple(
+                int(round(coordinate * factor)) for coordinate in track.location
+            )
+
+    def rename(self, name, new_name):
+        for track in self.tracks.values():
+            if track.name == name:
+                track.name = new_name
+
+    def forget(self, name):
+        """Recognize the tracks labelled name again, e.g. after it was removed"""
+        for track in self.tracks.values():
+            if track.name == name:
+                track.name = None
+                track.confidence = 0.0
+                track.recognized_at = None
@@ -1,39 +1,177 @@
+import hashlib
 import os
 import cv2
 import face_recognition
+import numpy as np
+
+from frame_scale import FrameScale
+from time_log import profiled, timed
+
+ENCODING_CACHE_VERSION = 2
+# Stored next to the images directory, e.g. images -> images.encodings.npz
+ENCODING_CACHE_SUFFIX = ".encodings.npz"
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_encoding_cache(cache_path):
+    """Return {path: entry} from a previous run, or {} if there is no usable cache"""
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if int(cache["version"]) != ENCODING_CACHE_VERSION:
+                return {}
+            return {
+                str(path): {
+                    "size": int(size),
+                    "mtime": int(mtime),
+                    "digest": str(digest),
+                    "encoding": encoding if has_face else None,
+                }
+                for path, size, mtime, digest, encoding, has_face in zip(
+                    cache["paths"],
+                    cache["sizes"],
+                    cache["mtimes"],
+                    cache["digests"],
+                    cache["encodings"],
+                    cache["has_face"],
+                )
+            }
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring unreadable encoding cache {cache_path}: {e}")
+        return {}
+
+
+def _write_encoding_cache(cache_path, entries):
+    paths = sorted(entries)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            version=np.array(ENCODING_CACHE_VERSION),
+            paths=np.array(paths, dtype=str),
+            sizes=np.array([entries[p]["size"] for p in paths], dtype=np.int64),
+            mtimes=np.array([entries[p]["mtime"] for p in paths], dtype=np.int64),
+            digests=np.array([entries[p]["digest"] for p in paths], dtype=str),
+            encodings=np.array(
+                [
+                    np.full(128, np.nan)
+                    if entries[p]["encoding"] is None
+                    else entries[p]["encoding"]
+                    for p in paths
+                ],
+                dtype=np.float64,
+            ).reshape(len(paths), 128),
+            # Images without a face are cached too, so they are not decoded and
+            # searched again on every start
+            has_face=np.array(
+                [entries[p]["encoding"] is not None for p in paths], dtype=bool
+            ),
+        )
+    # Replace in one step so a crash mid-write never leaves a truncated cache
+    os.replace(tmp_path, cache_path)
+
+
+def load_know_images(images_dir="images", cache_path=None):
+    """Encode every image in images_dir, reusing encodings cached on disk.
 
+    Entries are keyed by path and validated by size and mtime; when those
+    change the content hash decides whether the image really has to be
+    re-encoded. Images in which no face was found are remembered the same
+    way. Images that were removed from images_dir are evicted.
+    """
+    if cache_path is None:
+        cache_path = f"{os.path.normpath(images_dir)}{ENCODING_CACHE_SUFFIX}"
 
-def load_know_images(images_dir="images"):
-    known_face_encodings = []
-    known_face_names = []
+    cached = _read_encoding_cache(cache_path)
+    entries = {}
+    changed = False
 
-    for image in os.listdir(images_dir):
-        print(f"{images_dir}/{image}")
-        image_file = face_recognition.load_image_file(f"{images_dir}/{image}")
-        image_encoding = face_recognition.face_encodings(image_file)[0]
+    for image in sorted(os.listdir(images_dir)):
+        path = f"{images_dir}/{image}"
+        stat = os.stat(path)
+        entry = cached.get(path)
 
-        known_face_encodings.append(image_encoding)
-        known_face_names.append(image.split(".")[0])
+        unchanged = entry and (entry["size"], entry["mtime"]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+        if unchanged:
+            entries[path] = entry
+            continue
+
+        digest = _file_digest(path)
+        if entry and entry["digest"] == digest:
+            # Touched or copied over but unchanged, keep the old encoding
+            entry.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+            entries[path] = entry
+            changed = True
+            continue
+
+        print(path)
+        image_file = face_recognition.load_image_file(path)
+        image_encodings = face_recognition.face_encodings(image_file)
+        if not image_encodings:
+            print(f"No face found in {path}, skipping")
+
+        entries[path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "digest": digest,
+            "encoding": image_encodings[0] if image_encodings else None,
+        }
+        changed = True
+
+    if changed or entries.keys() != cached.keys():
+        _write_encoding_cache(cache_path, entries)
+
+    faces = [path for path in entries if entries[path]["encoding"] is not None]
+    known_face_encodings = [entries[path]["encoding"] for path in faces]
+    known_face_names = [os.path.basename(path).split(".")[0] for path in faces]
 
     return known_face_encodings, known_face_names
 
 
-def pre_process_frame(frame):
-    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+def add_to_encoding_cache(path, encoding, images_dir="images", cache_path=None):
+    """Cache an encoding computed elsewhere for an image saved into images_dir.
+
+    The next load_know_images() then picks it up without encoding the image.
+    """
+    if cache_path is None:
+        cache_path = f"{os.path.normpath(images_dir)}{ENCODING_CACHE_SUFFIX}"
+
+    entries = _read_encoding_cache(cache_path)
+    stat = os.stat(path)
+    entries[path] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "digest": _file_digest(path),
+        "encoding": np.asarray(encoding, dtype=np.float64),
+    }
+    _write_encoding_cache(cache_path, entries)
 
-    # Convert the image from BGR color (which OpenCV uses) to RGB color (which face_recognition uses)
-    rgb_small_frame = small_frame[:, :, ::-1]
 
-    return rgb_small_frame
+@profiled("pre_process")
+def pre_process_frame(frame, frame_scale=None):
+    """RGB copy of frame at the detection scale, 1/4 size unless frame_scale says"""
+    return (frame_scale or FrameScale()).shrink(frame)
 
 
-def draw_processed_frame(frame, face_locations, face_names, show_gui=True):
-    for (top, right, bottom, left), name in zip(face_locations, face_names):
-        # Scale back up face locations since the frame we detected in was scaled to 1/4 size
-        top *= 4
-        right *= 4
-        bottom *= 4
-        left *= 4
+@profiled("draw")
+def draw_processed_frame(
+    frame, face_locations, face_names, show_gui=True, frame_scale=None
+):
+    frame_scale = frame_scale or FrameScale()
+    for location, name in zip(face_locations, face_names):
+        # Scale back up face locations since the frame we detected in was scaled down
+        top, right, bottom, left = frame_scale.to_frame(location)
 
         # Draw a box around the face
         cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
@@ -51,28 +189,43 @@ def draw_processed_frame(frame, face_locations, face_names, show_gui=True):
         cv2.waitKey(1)
     return frame
 
-def find_faces(known_face_encodings, known_face_names, rgb_small_frame):
-    face_locations = face_recognition.face_locations(rgb_small_frame)
-    face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-
-    face_names = []
-    for face_encoding in face_encodings:
-        # See if the face is a match for the known face(s)
-        matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-        name = "Unknown"
-
-        # If a match was found in known_face_encodings, just use the first one.
-        if True in matches:
-            first_match_index = matches.index(True)
-            name = known_face_names[first_match_index]
-
-        # # Or instead, use the known face with the smallest distance to the new face
-        # face_distances = face_recognition.face_distance(
-        #     known_face_encodings, face_encoding
-        # )
-        # best_match_index = np.argmin(face_distances)
-        # if matches[best_match_index]:
-        #     name = known_face_names[best_match_index]
-
-        face_names.append(name)
+def detect_faces(rgb_small_frame, detector=None):
+    """Face locations in rgb_small_frame, from detector if given, e.g. a RoiDetector"""
+    with timed("detect"):
+        if detector is not None:
+            return detector.detect(rgb_small_frame)
+        return face_recognition.face_locations(rgb_small_frame)
+
+
+def find_faces(
+    matcher, rgb_small_frame, tracker=None, with_confidences=False, detector=None
+):
+    """Return (face_locations, face_names), plus face_confidences if asked for"""
+    face_locations = detect_faces(rgb_small_frame, detector)
+
+    if tracker is None:
+        with timed("encode"):
+            face_encodings = face_recognition.face_encodings(
+                rgb_small_frame, face_locations
+            )
+        # Use the known face with the smallest distance to each new face
+        face_names, face_confidences = matcher.identify(face_encodings)
+    else:
+        # Only encode faces that are new or due for re-verification
+        tracks = tracker.update(face_locations)
+        due = tracker.due(tracks)
+        if due:
+            with timed("encode"):
+                face_encodings = face_recognition.face_encodings(
+                    rgb_small_frame, [track.location for track in due]
+                )
+            face_names, face_confidences = matcher.identify(face_encodings)
+            tracker.apply(
+                [track.track_id for track in due], face_names, face_confidences
+            )
+        face_names = [track.label for track in tracks]
+        face_confidences = [track.confidence for track in tracks]
+
+    if with_confidences:
+        return face_locations, face_names, face_confidences
     return face_locations, face_names
@@ -0,0 +1,120 @@
+import multiprocessing as mp
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+def start_resource_tracker():
+    """Start the tracker before any worker so that workers inherit it"""
+    if os.name == "posix":
+        resource_tracker.ensure_running()
+
+
+class FrameRing:
+    """Fixed-size ring of frame slots in shared memory.
+
+    The capture loop copies each frame into the next slot and only sends the
+    small (slot, seq) descriptor to the workers, which read the slot in place
+    instead of unpickling a fresh copy of the frame. Every slot carries the
+    sequence number of the frame it holds, so a reader can tell when the
+    writer has lapped it and the data it looked at is no longer that frame.
+    """
+
+    def __init__(self, frame_shape, n_slots=4, dtype=np.uint8, name=None):
+        self.frame_shape = tuple(frame_shape)
+        self.n_slots = n_slots
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        header_bytes = n_slots * np.dtype(np.int64).itemsize
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=header_bytes + n_slots * frame_bytes
+            )
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if os.name == "posix" and mp.parent_process() is None:
+                # Attaching registers the block with this process's resource
+                # tracker, which would unlink it under the owner when we exit.
+                # multiprocessing children share the owner's tracker instead.
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        # A slot whose seq is 0 is empty or being written
+        self._seqs = np.ndarray((n_slots,), dtype=np.int64, buffer=self.shm.buf)
+        self._frames = np.ndarray(
+            (n_slots, *self.frame_shape),
+            dtype=self.dtype,
+            buffer=self.shm.buf,
+            offset=header_bytes,
+        )
+        if self.owner:
+            self._seqs[:] = 0
+        self._next_seq = 1
+
+    @property
+    def spec(self):
+        """Picklable description another process can pass to FrameRing.attach"""
+        return (self.shm.name, self.frame_shape, self.n_slots, self.dtype.str)
+
+    @classmethod
+    def attach(cls, spec):
+        name, frame_shape, n_slots, dtype = spec
+        return cls(frame_shape, n_slots=n_slots, dtype=dtype, name=name)
+
+    def write(self, frame):
+        """Copy frame into the next slot and return its (slot, seq)"""
+        seq = self._next_seq
+        self._next_seq += 1
+        slot = seq % self.n_slots
+
+        self._seqs[slot] = 0
+        np.copyto(self._frames[slot], frame)
+        self._seqs[slot] = seq
+        return slot, seq
+
+    def read(self, slot, seq):
+        """Return a zero-copy view of the frame, or None if the slot moved on"""
+        if self._seqs[slot] != seq:
+            return None
+        return self._frames[slot]
+
+    def is_current(self, slot, seq):
+        """True while the slot still holds frame seq, check after using a view"""
+        return self._seqs[slot] == seq
+
+    def close(self):
+        # Views into the buffer must be gone before the mapping can be closed
+        del self._seqs, self._frames
+        try:
+            self.shm.close()
+        except BufferError:
+            # A caller still holds a view, the mapping goes away with the process
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+
+class FrameRingReader:
+    """Worker side of a FrameRing, attaches to rings lazily from descriptors"""
+
+    def __init__(self):
+        self.rings = {}
+
+    def _ring(self, frame_data):
+        spec = frame_data["ring"]
+        if spec[0] not in self.rings:
+            self.rings[spec[0]] = FrameRing.attach(spec)
+        return self.rings[spec[0]]
+
+    def read(self, frame_data):
+        return self._ring(frame_data).read(frame_data["slot"], frame_data["seq"])
+
+    def is_current(self, frame_data):
+        return self._ring(frame_data).is_current(frame_data["slot"], frame_data["seq"])
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
@@ -0,0 +1,108 @@
+import collections
+import os
+
+import cv2
+
+# A fraction like 0.25, or "auto" to follow the size of the faces in view
+DEFAULT_SCALE = os.environ.get("FACE_DETECTION_SCALE", "0.25")
+# Scales auto mode picks from, coarsest first
+AUTO_SCALES = (0.125, 0.25, 0.5)
+# Smallest face, in detection pixels, HOG still finds reliably with one upsample
+MIN_FACE_PIXELS = 48
+
+
+class FrameScale:
+    """Maps face locations between a frame and its downscaled detection copy.
+
+    Detection, tracking and encoding work on the copy made by shrink(), and
+    everything that draws on, crops or reports about the full frame converts
+    with to_frame(). Locations are (top, right, bottom, left) tuples.
+    """
+
+    def __init__(self, scale=0.25):
+        scale = float(scale)
+        if not 0.0 < scale <= 1.0:
+            raise ValueError(f"Detection scale must be in (0, 1], got {scale}")
+        self.scale = scale
+
+    def __eq__(self, other):
+        return isinstance(other, FrameScale) and self.scale == other.scale
+
+    def __hash__(self):
+        return hash(self.scale)
+
+    def __repr__(self):
+        return f"FrameScale({self.scale})"
+
+    def shrink(self, frame):
+        """RGB detection copy of a BGR frame"""
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+        # OpenCV frames are BGR, face_recognition wants RGB
+        return frame[:, :, ::-1]
+
+    def to_frame(self, location):
+        """Detection location scaled back up to full frame pixels"""
+        return tuple(int(round(coordinate / self.scale)) for coordinate in location)
+
+
+class DetectionScale:
+    """The detection scale setting, fixed or picked from the faces seen.
+
+    scale is a fraction, e.g. 0.5 for a distant camera or 0.125 for a
+    close-up kiosk, or "auto". In auto mode observe() keeps the smallest face
+    of each of the last `window` detections and, once the window is full,
+    switches to the coarsest of auto_scales at which all of them would still
+    be min_face detection pixels tall. With no faces in the window it goes
+    back to the finest scale, so small newcomers can be found.
+    """
+
+    def __init__(
+        self,
+        scale=DEFAULT_SCALE,
+        auto_scales=AUTO_SCALES,
+        min_face=MIN_FACE_PIXELS,
+        window=30,
+    ):
+        self.auto = scale == "auto"
+        self.scales = sorted(auto_scales) if self.auto else [float(scale)]
+        self.min_face = min_face
+        self.frame_scale = FrameScale(self.scales[-1])
+        # Smallest face height in full frame pixels per detection, None if none
+        self._face_sizes = collections.deque(maxlen=window)
+
+    def observe(self, face_locations):
+        """Record the faces found at frame_scale.
+
+        Returns the factor from the old to the new detection coordinates when
+        the scale changes, for rescaling anything that holds locations, or
+        None.
+        """
+        if not self.auto:
+            return None
+
+        self._face_sizes.append(
+            min(bottom - top for top, _, bottom, _ in face_locations)
+            / self.frame_scale.scale
+            if face_locations
+            else None
+        )
+        if len(self._face_sizes) < self._face_sizes.maxlen:
+            return None
+
+        face_sizes = [size for size in self._face_sizes if size is not None]
+        scale = self.scales[-1]
+        if face_sizes:
+            smallest = min(face_sizes)
+            scale = next(
+                (s for s in self.scales if smallest * s >= self.min_face), scale
+            )
+        if scale == self.frame_scale.scale:
+            return None
+
+        factor = scale / self.frame_scale.scale
+        print(f"Detection scale: {self.frame_scale.scale} -> {scale}")
+        self.frame_scale = FrameScale(scale)
+        # Judge the new scale on what it sees itself
+        self._face_sizes.clear()
+        return factor
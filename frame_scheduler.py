@@ -0,0 +1,167 @@
+import time
+
+
+def _ewma(previous, value, smoothing):
+    if previous is None:
+        return value
+    return previous + smoothing * (value - previous)
+
+
+class AdaptiveScheduler:
+    """Pick which frames get detection and recognition from measured load.
+
+    Replaces the fixed process_this_frame toggle. The scheduler processes one
+    frame out of every `interval` and re-evaluates the interval every
+    adjust_every frames: it backs off while processing is what keeps the
+    loop from keeping up or the worker queue is backing up, and processes
+    more often when the identities shown get older than max_latency or when
+    there is headroom to do so.
+
+    frame_done() counts the frames of the source, so a source slower than
+    target_fps is no reason to back off: the target is capped at the rate
+    the source delivers.
+
+    inline says whether processing runs in the same loop that calls
+    frame_done(). Then the loop is overloaded when processing pulls FPS
+    below the target, and the cost of processing one more frame is
+    predicted from processing_time. Otherwise processing runs beside the
+    loop and is overloaded when one frame takes longer than the frames it
+    is picked from.
+    """
+
+    def __init__(
+        self,
+        target_fps=15.0,
+        max_latency=0.5,
+        max_interval=8,
+        max_queue_depth=1,
+        adjust_every=10,
+        hysteresis=0.1,
+        smoothing=0.1,
+        inline=True,
+    ):
+        self.target_fps = target_fps
+        self.max_latency = max_latency
+        self.max_interval = max_interval
+        self.max_queue_depth = max_queue_depth
+        self.adjust_every = adjust_every
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.inline = inline
+
+        self.interval = 1
+        self.frame_time = None
+        self.processing_time = None
+        self.latency = None
+        self.queue_depth = 0
+        self.processed_frames = 0
+        self.skipped_frames = 0
+
+        self._last_frame = None
+        self._frames_since_processed = 0
+        self._frames_since_adjust = 0
+
+    def should_process(self):
+        self._frames_since_processed += 1
+        if self._frames_since_processed >= self.interval:
+            self._frames_since_processed = 0
+            self.processed_frames += 1
+            return True
+        self.skipped_frames += 1
+        return False
+
+    def record_processing(self, seconds):
+        """Detection + encoding + matching time of one processed frame"""
+        self.processing_time = _ewma(self.processing_time, seconds, self.smoothing)
+
+    def record_latency(self, seconds):
+        """Capture-to-result time of one recognition, for out-of-loop workers"""
+        self.latency = _ewma(self.latency, seconds, self.smoothing)
+
+    def record_queue_depth(self, depth):
+        self.queue_depth = depth
+
+    def frame_done(self):
+        """Call once per displayed frame"""
+        now = time.perf_counter()
+        if self._last_frame is not None:
+            self.frame_time = _ewma(
+                self.frame_time, now - self._last_frame, self.smoothing
+            )
+        self._last_frame = now
+
+        self._frames_since_adjust += 1
+        if self._frames_since_adjust >= self.adjust_every and self.frame_time:
+            self._frames_since_adjust = 0
+            self._adjust()
+
+    @property
+    def fps(self):
+        return 1.0 / self.frame_time if self.frame_time else 0.0
+
+    @property
+    def identity_age(self):
+        """How old the shown identities get: result latency plus frames skipped"""
+        latency = self.latency if self.latency is not None else self.processing_time
+        return (latency or 0.0) + (self.interval - 1) * (self.frame_time or 0.0)
+
+    def _source_fps(self):
+        """FPS the loop would run at without any processing"""
+        if not self.inline or not self.processing_time:
+            return self.fps
+        source_time = self.frame_time - self.processing_time / self.interval
+        return 1.0 / source_time if source_time > 0 else float("inf")
+
+    def _predicted_fps(self, interval):
+        if not self.inline or not self.processing_time:
+            return self.fps
+        # One more processed frame per cycle of `interval` frames
+        extra = self.processing_time * (1.0 / interval - 1.0 / self.interval)
+        return 1.0 / (self.frame_time + extra)
+
+    def _overloaded(self):
+        """Whether processing, not the source, is what the loop cannot keep up with"""
+        if not self.processing_time:
+            return False
+        if self.inline:
+            target = min(self.target_fps, self._source_fps())
+            return self.fps < target * (1 - self.hysteresis)
+        return self.processing_time > self.frame_time * self.interval
+
+    def _has_headroom(self, interval):
+        """Whether processing one in `interval` frames would not overload"""
+        if not self.processing_time:
+            return True
+        if self.inline:
+            target = min(self.target_fps, self._source_fps() * (1 - self.hysteresis))
+            return self._predicted_fps(interval) >= target
+        return self.processing_time <= self.frame_time * interval * (
+            1 - self.hysteresis
+        )
+
+    def _adjust(self):
+        interval = self.interval
+        backlog = self.queue_depth > self.max_queue_depth
+
+        if (self._overloaded() or backlog) and interval < self.max_interval:
+            interval += 1
+        elif interval > 1 and not backlog:
+            too_old = self.identity_age > self.max_latency
+            if too_old or self._has_headroom(interval - 1):
+                interval -= 1
+
+        if interval != self.interval:
+            self.interval = interval
+            print(f"Scheduler: {self.metrics}")
+
+    @property
+    def metrics(self):
+        return {
+            "interval": self.interval,
+            "fps": round(self.fps, 1),
+            "processing_ms": round((self.processing_time or 0.0) * 1000, 1),
+            "identity_age_ms": round(self.identity_age * 1000, 1),
+            "queue_depth": self.queue_depth,
+            "processed_frames": self.processed_frames,
+            "skipped_frames": self.skipped_frames,
+        }
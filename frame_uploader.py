@@ -0,0 +1,121 @@
+import collections
+import threading
+
+import requests
+
+from time_log import timed
+
+
+def _multipart_part(body, content_type):
+    # Content-Length lets the receiver read the body without scanning for the boundary
+    return (
+        f"--frame\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode()
+        + body
+        + b"\r\n"
+    )
+
+
+class FrameUploader:
+    """Send processed frames to the Pi from a background thread.
+
+    send() only queues the frame and drops the oldest queued one when the Pi
+    falls behind, so the recognition loop never waits on the network. Frames
+    are JPEGs, or with content_type="application/json" just the metadata for
+    the Pi to draw itself.
+
+    With streaming (the default) every frame goes out over one long-lived
+    chunked multipart POST to url, e.g. the Pi's /processed_stream. Without
+    it each frame is its own POST, e.g. to /processed_frame, over a
+    keep-alive session that reuses the connection. Either way a dropped
+    connection is re-opened after retry_delay seconds.
+    """
+
+    def __init__(
+        self,
+        url,
+        streaming=True,
+        content_type="image/jpeg",
+        max_queue=2,
+        retry_delay=1.0,
+    ):
+        self.url = url
+        self.streaming = streaming
+        self.content_type = content_type
+        self.retry_delay = retry_delay
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.failed_uploads = 0
+        self._queue = collections.deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._upload_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def send(self, body):
+        """Queue one frame for upload, never blocks"""
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped_frames += 1
+            self._queue.append(body)
+            self._cond.notify()
+
+    def _take(self, timeout):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._queue or self._stopped.is_set(), timeout
+            )
+            return self._queue.popleft() if self._queue else None
+
+    def _parts(self):
+        """Request body of the streaming upload, ends when the uploader stops"""
+        while not self._stopped.is_set():
+            body = self._take(timeout=0.5)
+            if body is None:
+                continue
+            # Resumes once the part was handed to the socket
+            with timed("upload"):
+                yield _multipart_part(body, self.content_type)
+            self.sent_frames += 1
+        yield b"--frame--\r\n"
+
+    def _upload_loop(self):
+        session = requests.Session()
+        while not self._stopped.is_set():
+            try:
+                if self.streaming:
+                    session.post(
+                        self.url,
+                        data=self._parts(),
+                        headers={
+                            "Content-Type": "multipart/x-mixed-replace; boundary=frame"
+                        },
+                        timeout=(5, None),
+                    )
+                    continue
+
+                body = self._take(timeout=0.5)
+                if body is None:
+                    continue
+                with timed("upload"):
+                    session.post(
+                        self.url,
+                        data=body,
+                        headers={"Content-Type": self.content_type},
+                        timeout=5,
+                    )
+                self.sent_frames += 1
+            except requests.exceptions.RequestException as e:
+                self.failed_uploads += 1
+                print("Failed to send frame to Raspberry Pi:", e)
+                self._stopped.wait(self.retry_delay)
+        session.close()
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join(timeout=2)
@@ -0,0 +1,88 @@
+
+import cv2
+import numpy as np
+
+from frame_scale import FrameScale
+from time_log import timed
+
+# imread flags that decode in the DCT domain straight to 1/2, 1/4 and 1/8 size
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Start-of-frame markers that carry the image size, SOF0..SOF15 minus DHT/JPG/DAC
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data):
+    """Return (height, width) from the JPEG header, without decoding, or None"""
+    i = 2  # Skip SOI
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = int.from_bytes(data[i + 5 : i + 7], "big")
+            width = int.from_bytes(data[i + 7 : i + 9], "big")
+            return height, width
+        i += 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+    return None
+
+
+class JpegFrame:
+    """A JPEG from the stream, decoded only as far as someone needs it.
+
+    Detection asks for rgb_small(), which at 1/2, 1/4 and 1/8 scale decodes
+    straight to that size in the DCT domain instead of decoding 640x480 and
+    throwing most of it away.
+    The full-resolution frame is only decoded when it is drawn, shown or
+    cropped, and then only once.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._full = None
+        self._size = None
+
+    @property
+    def shape(self):
+        """(height, width, 3) of the full frame, read from the JPEG header"""
+        if self._full is not None:
+            return self._full.shape
+        if self._size is None:
+            self._size = jpeg_size(self.data)
+            if self._size is None:  # Unusual header, decode to find out
+                return self.full().shape
+        return (*self._size, 3)
+
+    def small(self, scale=4):
+        """BGR frame at 1/scale size, scale is 1, 2, 4 or 8"""
+        if scale == 1:
+            return self.full()
+        with timed("decode_small"):
+            return cv2.imdecode(
+                np.frombuffer(self.data, np.uint8), REDUCED_DECODE_FLAGS[scale]
+            )
+
+    def rgb_small(self, frame_scale=None):
+        """Same as pre_process_frame(self.full(), frame_scale), mostly far cheaper"""
+        frame_scale = frame_scale or FrameScale()
+        divisor = 1.0 / frame_scale.scale
+        if divisor in REDUCED_DECODE_FLAGS:
+            return self.small(int(divisor))[:, :, ::-1]
+        return frame_scale.shrink(self.full())
+
+    def full(self):
+        if self._full is None:
+            with timed("decode_full"):
+                self._full = cv2.imdecode(
+                    np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR
+                )
+        return self._full
+
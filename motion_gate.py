@@ -0,0 +1,68 @@
+import cv2
+
+from time_log import timed
+
+
+class MotionGate:
+    """Skip detection on frames where nothing moved since the last processed one.
+
+    Each frame is shrunk to a thumbnail_size grayscale thumbnail and compared
+    with the thumbnail of the last frame that was let through. The score is
+    the share of thumbnail pixels that changed by more than pixel_threshold
+    grey levels. A still scene needs a score over start_threshold to be
+    processed again, a moving one keeps being processed until the score drops
+    under stop_threshold, so noise around one threshold does not make the
+    gate flicker. Every max_skip skipped frames one is let through anyway, so
+    slow drift and people standing still are still seen.
+    """
+
+    def __init__(
+        self,
+        start_threshold=0.005,
+        stop_threshold=0.002,
+        pixel_threshold=12,
+        max_skip=30,
+        thumbnail_size=(64, 48),
+    ):
+        self.start_threshold = start_threshold
+        self.stop_threshold = stop_threshold
+        self.pixel_threshold = pixel_threshold
+        self.max_skip = max_skip
+        self.thumbnail_size = thumbnail_size
+        self.reference = None
+        self.moving = False
+        self.score = 0.0
+        self.skipped_frames = 0
+        self._since_processed = 0
+
+    def _thumbnail(self, frame):
+        thumbnail = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            # Channel order does not matter for a change score
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        return thumbnail
+
+    def should_process(self, frame):
+        """Whether frame (BGR, RGB or gray, any size) changed enough to detect on"""
+        with timed("motion_gate"):
+            thumbnail = self._thumbnail(frame)
+            if self.reference is None:
+                self.score = 1.0
+            else:
+                changed = cv2.absdiff(thumbnail, self.reference) > self.pixel_threshold
+                self.score = float(changed.mean())
+
+        threshold = self.stop_threshold if self.moving else self.start_threshold
+        self.moving = self.score > threshold
+        if self.moving or self._since_processed >= self.max_skip:
+            self.reference = thumbnail
+            self._since_processed = 0
+            return True
+
+        self._since_processed += 1
+        self.skipped_frames += 1
+        return False
+
+    def reset(self):
+        """Let the next frame through, e.g. after the camera was switched"""
+        self.reference = None
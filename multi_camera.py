@@ -0,0 +1,344 @@
+import collections
+import json
+import threading
+import time
+
+import cv2
+
+import time_log
+from async_mjpeg import MjpegClient
+from channels import LatestChannel
+from face_detector import RoiDetector
+from face_tracker import FaceTracker
+from face_utils import detect_faces, pre_process_frame
+from frame_scale import DEFAULT_SCALE, DetectionScale
+from motion_gate import MotionGate
+from pipeline import labelled
+from recognition_pool import RecognitionPool
+from stream_reader import LatestFrameReader
+
+
+def is_url(source):
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+
+def open_capture(source):
+    """Capture for a camera index or anything else cv2 can open.
+
+    Pi MJPEG URLs are read by the server's MjpegClient instead.
+    """
+    if isinstance(source, int) or source.isdigit():
+        video_capture = cv2.VideoCapture(int(source))
+        video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 0)
+        return video_capture
+    return cv2.VideoCapture(source)
+
+
+class Camera:
+    """One source of a MultiCameraServer with its own detection state.
+
+    Frames are numpy BGR frames or, from a Pi MJPEG URL read on the
+    MjpegClient's event loop, JpegFrames that are only decoded at the
+    detection scale.
+    """
+
+    def __init__(
+        self,
+        name,
+        source,
+        scale=DEFAULT_SCALE,
+        roi_sweep=10,
+        gate=True,
+        mjpeg_client=None,
+    ):
+        self.name = name
+        self.source = source
+        if is_url(source):
+            if mjpeg_client is None:
+                raise ValueError(f"{name}: a URL source needs an MjpegClient")
+            self.reader = mjpeg_client.open(source)
+        else:
+            self.reader = LatestFrameReader(open_capture(source))
+        self.tracker = FaceTracker()
+        self.detector = RoiDetector(sweep_every=roi_sweep) if roi_sweep else None
+        self.motion_gate = MotionGate() if gate else None
+        self.scale = DetectionScale(scale)
+        self.detections = LatestChannel()
+        # Pool results for this camera, applied by whoever processes it next
+        self.results = collections.deque()
+        self.version = 0
+        self.busy = False
+
+        self.processed_frames = 0
+        self.gated_frames = 0
+        self.skipped_frames = 0
+        self.recognized_faces = 0
+        # Capture to detection published, and capture to identity applied
+        self.detect_latency = time_log.Histogram()
+        self.recognition_latency = time_log.Histogram()
+        self._window = (time.monotonic(), 0, 0)
+
+    def gate_image(self, frame):
+        return frame.small(8) if hasattr(frame, "small") else frame
+
+    def detection_frame(self, frame, frame_scale):
+        if hasattr(frame, "rgb_small"):
+            return frame.rgb_small(frame_scale)
+        return pre_process_frame(frame, frame_scale)
+
+    def apply_results(self, gallery_version):
+        """Attach the pool results that came in for this camera to its tracks"""
+        applied = 0
+        while self.results:
+            result = self.results.popleft()
+            if result["gallery_version"] < gallery_version:
+                # Matched before the last gallery update, match again
+                self.tracker.retry(result["track_ids"])
+                continue
+            self.tracker.apply(
+                result["track_ids"], result["names"], result["confidences"]
+            )
+            self.recognition_latency.record(time.time() - result["timestamp"])
+            self.recognized_faces += len(result["names"])
+            applied += 1
+        return applied
+
+    def report(self):
+        """FPS since the last report, latencies and counters"""
+        now = time.monotonic()
+        start, captured, processed = self._window
+        captured_now = self.reader.frames.version
+        elapsed = max(now - start, 1e-3)
+        self._window = (now, captured_now, self.processed_frames)
+        report = {
+            "camera": self.name,
+            "capture_fps": round((captured_now - captured) / elapsed, 1),
+            "processed_fps": round((self.processed_frames - processed) / elapsed, 1),
+            "processed_frames": self.processed_frames,
+            "gated_frames": self.gated_frames,
+            "skipped_frames": self.skipped_frames,
+            "failed_reads": self.reader.failed_reads,
+            "faces": len(self.tracker.tracks),
+            "recognized_faces": self.recognized_faces,
+            "detect_latency": self.detect_latency.summary(),
+            "recognition_latency": self.recognition_latency.summary(),
+        }
+        if hasattr(self.reader, "stats"):
+            # Parts dropped unread and how far behind the stream is; frames
+            # left undecoded are the skipped_frames above
+            report["stream"] = self.reader.stats()
+            del report["stream"]["dropped_frames"]
+        return report
+
+
+class MultiCameraServer:
+    """Recognize faces on many cameras with one gallery and one worker pool.
+
+    Every camera keeps only its newest frame waiting, so one nobody keeps up
+    with does not build a backlog. Pi MJPEG URLs are all read by one
+    MjpegClient on a single event loop, other sources each by a
+    LatestFrameReader. detect_threads threads serve the cameras round robin,
+    one frame each per turn, starting after the camera served last, so a
+    busy camera cannot starve the others of detection or of pool slots.
+    Still cameras cost a thumbnail per frame thanks to their MotionGate, and
+    moving ones mostly only the area around their faces thanks to their
+    RoiDetector.
+
+    All cameras share one RecognitionPool, so the gallery is held once per
+    worker instead of once per camera and idle cameras leave their share of
+    the workers to busy ones. Results are routed back by camera name.
+
+    Each camera's newest detection is in cameras[i].detections, with the
+    same fields as a FacePipeline detection plus "camera".
+    """
+
+    def __init__(
+        self,
+        sources,
+        matcher,
+        n_workers=None,
+        detect_threads=1,
+        min_confidence=0.0,
+        scale=DEFAULT_SCALE,
+        roi_sweep=10,
+        gate=True,
+        report_every=10.0,
+    ):
+        if isinstance(sources, dict):
+            sources = list(sources.items())
+        else:
+            sources = [(f"camera{i}", source) for i, source in enumerate(sources)]
+        self.mjpeg_client = (
+            MjpegClient() if any(is_url(source) for _, source in sources) else None
+        )
+        self.cameras = [
+            Camera(
+                name,
+                source,
+                scale=scale,
+                roi_sweep=roi_sweep,
+                gate=gate,
+                mjpeg_client=self.mjpeg_client,
+            )
+            for name, source in sources
+        ]
+        self._cameras_by_name = {camera.name: camera for camera in self.cameras}
+        if len(self._cameras_by_name) != len(self.cameras):
+            raise ValueError("Camera names must be unique")
+
+        self.pool = RecognitionPool(
+            matcher, n_workers=n_workers, min_confidence=min_confidence
+        )
+        self.report_every = report_every
+        self._next_camera = 0
+        self._frame_id = 0
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._detect_loop, daemon=True)
+            for _ in range(detect_threads)
+        ]
+        if report_every:
+            self._threads.append(
+                threading.Thread(target=self._report_loop, daemon=True)
+            )
+
+    def start(self):
+        for camera in self.cameras:
+            camera.reader.start()
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _take_camera(self):
+        """Next camera round robin with a frame it has not seen, marked busy"""
+        with self._lock:
+            for i in range(len(self.cameras)):
+                index = (self._next_camera + i) % len(self.cameras)
+                camera = self.cameras[index]
+                if camera.busy or camera.reader.frames.version == camera.version:
+                    continue
+                version, item = camera.reader.frames.latest()
+                if camera.version:
+                    camera.skipped_frames += version - camera.version - 1
+                camera.version = version
+                camera.busy = True
+                self._next_camera = index + 1
+                self._frame_id += 1
+                return camera, self._frame_id, item
+        return None, None, None
+
+    def _detect_loop(self):
+        while not self._stopped.is_set():
+            camera, frame_id, item = self._take_camera()
+            if camera is None:
+                time.sleep(0.005)
+                continue
+            try:
+                self._process(camera, frame_id, item)
+            except Exception as e:
+                print(f"Error processing {camera.name}: {e}")
+            finally:
+                camera.busy = False
+
+    def _process(self, camera, frame_id, item):
+        _, timestamp, frame = item
+        with self._pool_lock:
+            self._collect_results()
+
+        if camera.motion_gate is not None and not camera.motion_gate.should_process(
+            camera.gate_image(frame)
+        ):
+            camera.gated_frames += 1
+            # Nothing moved, keep the last detection but take in new results
+            _, detection = camera.detections.latest()
+            applied = camera.apply_results(self.pool.gallery_version)
+            if applied and detection is not None:
+                camera.detections.put(labelled(detection))
+            return
+
+        camera.apply_results(self.pool.gallery_version)
+        frame_scale = camera.scale.frame_scale
+        rgb_small_frame = camera.detection_frame(frame, frame_scale)
+        face_locations = detect_faces(rgb_small_frame, camera.detector)
+
+        tracks = camera.tracker.update(face_locations)
+        due = camera.tracker.due(tracks)
+        if due:
+            with self._pool_lock:
+                submitted = self.pool.submit(
+                    frame_id,
+                    rgb_small_frame,
+                    [track.location for track in due],
+                    track_ids=[track.track_id for track in due],
+                    stream=camera.name,
+                    timestamp=timestamp,
+                )
+            if submitted:
+                camera.tracker.mark_pending(due)
+
+        camera.processed_frames += 1
+        camera.detect_latency.record(time.time() - timestamp)
+        camera.detections.put(
+            labelled(
+                {
+                    "camera": camera.name,
+                    "frame_id": frame_id,
+                    "timestamp": timestamp,
+                    "frame": frame,
+                    "frame_scale": frame_scale,
+                    "face_locations": face_locations,
+                    "tracks": tracks,
+                }
+            )
+        )
+
+        factor = camera.scale.observe(face_locations)
+        if factor is not None:
+            camera.tracker.rescale(factor)
+            if camera.detector is not None:
+                camera.detector.reset()
+
+    def _collect_results(self):
+        """Hand finished results to their cameras, each applies its own"""
+        for result in self.pool.results():
+            self._cameras_by_name[result["stream"]].results.append(result)
+
+    def add_identity(self, name, encoding):
+        """Enroll encoding for every camera at once"""
+        with self._pool_lock:
+            self.pool.add_identity(name, encoding)
+
+    def remove_identity(self, name):
+        with self._pool_lock:
+            self.pool.remove_identity(name)
+        for camera in self.cameras:
+            camera.tracker.forget(name)
+
+    def report(self):
+        return {
+            "cameras": [camera.report() for camera in self.cameras],
+            "pool": {
+                "workers": self.pool.n_workers,
+                "queue_depth": self.pool.queue_depth(),
+                "stale_results": self.pool.stale_results,
+            },
+        }
+
+    def _report_loop(self):
+        while not self._stopped.wait(self.report_every):
+            print(json.dumps(self.report()))
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        for camera in self.cameras:
+            camera.reader.release()
+        if self.mjpeg_client is not None:
+            self.mjpeg_client.close()
+        self.pool.close()
+        if time_log.enabled:
+            print(time_log.profiler.report())
+
@@ -0,0 +1,205 @@
+import threading
+import time
+
+from channels import LatestChannel
+from face_tracker import FaceTracker
+from face_utils import detect_faces, pre_process_frame
+from frame_scale import DEFAULT_SCALE, DetectionScale, FrameScale
+from frame_scheduler import AdaptiveScheduler
+import time_log
+from recognition_pool import RecognitionPool
+from stream_reader import LatestFrameReader
+
+NO_DETECTION = {
+    "frame_id": 0,
+    "frame_scale": FrameScale(),
+    "face_locations": [],
+    "names": [],
+    "confidences": [],
+}
+
+
+def labelled(detection):
+    """detection with names and confidences read from its tracks now"""
+    tracks = detection["tracks"]
+    return dict(
+        detection,
+        names=[track.label for track in tracks],
+        confidences=[track.confidence for track in tracks],
+    )
+
+
+class FacePipeline:
+    """Capture -> detection -> encoding/matching -> render, each stage decoupled.
+
+    Capture runs in a LatestFrameReader, detection in its own thread and
+    encoding in the RecognitionPool processes. The render loop stays in the
+    caller's thread (cv2.imshow has to) and pulls the newest frame together
+    with the newest detection through next_frame(), so display FPS follows
+    the camera instead of the slowest stage.
+
+    scale is the detection scale, a fraction or "auto" (see DetectionScale).
+    Every detection carries the FrameScale it was made at, convert its
+    face_locations with detection["frame_scale"].to_frame() before drawing
+    on or cropping the full frame.
+    """
+
+    def __init__(
+        self,
+        video_capture,
+        matcher,
+        n_workers=None,
+        min_confidence=0.0,
+        tracker=None,
+        on_result=None,
+        scheduler=None,
+        detector=None,
+        motion_gate=None,
+        scale=DEFAULT_SCALE,
+    ):
+        self.reader = LatestFrameReader(video_capture)
+        self.pool = RecognitionPool(
+            matcher, n_workers=n_workers, min_confidence=min_confidence
+        )
+        self.tracker = tracker or FaceTracker()
+        # Detection runs beside the render loop, not inside it
+        self.scheduler = scheduler or AdaptiveScheduler(inline=False)
+        # None searches the whole frame every time, a RoiDetector mostly does not
+        self.detector = detector
+        # Frames the gate finds unchanged keep the previous detection
+        self.motion_gate = motion_gate
+        self.scale = DetectionScale(scale)
+        # Called from the detection thread with every fresh recognition result
+        self.on_result = on_result
+
+        self.detections = LatestChannel()
+        self.skipped_frames = 0
+        self._pool_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._detect_thread = threading.Thread(target=self._detect_loop, daemon=True)
+
+    def start(self):
+        self.reader.start()
+        self._detect_thread.start()
+        return self
+
+    def _detect_loop(self):
+        version = 0
+        while not self._stopped.is_set():
+            new_version, item = self.reader.frames.get(version, timeout=0.5)
+            if item is None:
+                continue
+            if version:
+                self.skipped_frames += new_version - version - 1
+            version = new_version
+            if not self.scheduler.should_process():
+                continue
+
+            frame_id, timestamp, frame = item
+            if self.motion_gate is not None and not self.motion_gate.should_process(
+                frame
+            ):
+                # Nothing moved, keep the last detection but take in new results
+                with self._pool_lock:
+                    applied = self._collect_results()
+                _, detection = self.detections.latest()
+                if applied and detection is not None:
+                    self.detections.put(labelled(detection))
+                continue
+            start = time.perf_counter()
+            frame_scale = self.scale.frame_scale
+            rgb_small_frame = pre_process_frame(frame, frame_scale)
+            face_locations = detect_faces(rgb_small_frame, self.detector)
+
+            # Only new tracks and tracks due for re-verification get encoded
+            tracks = self.tracker.update(face_locations)
+            due = self.tracker.due(tracks)
+            with self._pool_lock:
+                if due and self.pool.submit(
+                    frame_id,
+                    rgb_small_frame,
+                    [track.location for track in due],
+                    track_ids=[track.track_id for track in due],
+                    timestamp=timestamp,
+                ):
+                    self.tracker.mark_pending(due)
+                self.scheduler.record_processing(time.perf_counter() - start)
+                self.scheduler.record_queue_depth(self.pool.queue_depth())
+                self._collect_results()
+
+            self.detections.put(
+                labelled(
+                    {
+                        "frame_id": frame_id,
+                        "timestamp": timestamp,
+                        "frame": frame,
+                        "frame_scale": frame_scale,
+                        "face_locations": face_locations,
+                        "tracks": tracks,
+                    }
+                )
+            )
+
+            factor = self.scale.observe(face_locations)
+            if factor is not None:
+                # Tracks carry on at the new scale, detection starts with a sweep
+                with self._pool_lock:
+                    self.tracker.rescale(factor)
+                if self.detector is not None:
+                    self.detector.reset()
+
+    def _collect_results(self):
+        """Attach finished recognitions to their tracks, returns how many were used"""
+        applied = 0
+        for result in self.pool.results():
+            self.scheduler.record_latency(time.time() - result["timestamp"])
+            if result["gallery_version"] < self.pool.gallery_version:
+                # Matched before the last gallery update, match again
+                self.tracker.retry(result["track_ids"])
+                continue
+            self.tracker.apply(
+                result["track_ids"], result["names"], result["confidences"]
+            )
+            applied += 1
+            if self.on_result:
+                self.on_result(result)
+        return applied
+
+    def next_frame(self, timeout=1.0):
+        """Wait for a new captured frame, returns (frame, detection).
+
+        frame is a private copy that is safe to draw on, or None on timeout.
+        detection is the newest detection, which may lag a few frames behind.
+        """
+        item = self.reader.next(timeout=timeout)
+        if item is None:
+            return None, NO_DETECTION
+        self.scheduler.frame_done()
+        _, detection = self.detections.latest()
+        return item[2].copy(), detection or NO_DETECTION
+
+    def add_identity(self, name, encoding, track_id=None):
+        """Enroll encoding live, labelling the track it came from right away"""
+        with self._pool_lock:
+            self.pool.add_identity(name, encoding)
+            if track_id is not None:
+                # The track's own encoding is now in the gallery, distance 0
+                self.tracker.apply([track_id], [name], [1.0])
+
+    def remove_identity(self, name):
+        with self._pool_lock:
+            self.pool.remove_identity(name)
+            self.tracker.forget(name)
+
+    def rename_identity(self, name, new_name):
+        with self._pool_lock:
+            self.pool.rename_identity(name, new_name)
+            self.tracker.rename(name, new_name)
+
+    def stop(self):
+        self._stopped.set()
+        self.reader.stop()
+        self._detect_thread.join(timeout=1)
+        self.pool.close()
+        if time_log.enabled:
+            print(time_log.profiler.report())
@@ -1,5 +1,10 @@
-from flask import Flask, Response, request
+from flask import Flask, Response, jsonify, request
 import cv2
+import json
+
+from frame_broadcaster import FrameBroadcaster, FrameChannel, read_multipart
+from overlay_renderer import OverlayRenderer
+from rate_controller import RateController, limit_send_buffer
 
 app = Flask(__name__)
 
@@ -8,49 +13,74 @@ camera = cv2.VideoCapture(0)
 camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
 camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
 
-def generate_frames():
-    """Generate frames from the USB camera for real-time processing."""
-    while True:
-        ret, frame = camera.read()  # Read frame from the camera
-        if not ret:
-            continue
-        _, buffer = cv2.imencode(".jpg", frame)  # Encode the frame as JPEG
-        frame = buffer.tobytes()
-        yield (b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+def read_frame():
+    ret, frame = camera.read()  # Read frame from the camera
+    return frame if ret else None
+
+# Adapts JPEG quality, resolution and frame rate to each viewer's link. The
+# recognizer reads /video_feed, browsers the processed display: separate
+# controllers, so a slow browser cannot cut the recognizer's input quality.
+# Full quality 640x480 at 30 fps is 5-9 Mbps, so the feed has no bitrate
+# target and only steps down when its link cannot keep up
+feed_rate_controller = RateController(target_bitrate=None)
+display_rate_controller = RateController()
+# One capture thread shared by every viewer of /video_feed
+broadcaster = FrameBroadcaster(read_frame, feed_rate_controller).start()
 
 @app.route("/video_feed")
 def video_feed():
-    """Route for the live video feed."""
+    """Route for the live video feed, ?max_fps=N caps this viewer."""
+    limit_send_buffer(request.environ)
     return Response(
-        generate_frames(), mimetype="multipart/x-mixed-replace; boundary=frame"
+        broadcaster.mjpeg_stream(request.args.get("max_fps", type=float)),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
 # Endpoint to receive and display processed frames
-processed_frame = None
+processed_frames = FrameChannel(display_rate_controller)
+# Or only boxes and names, drawn here onto our own frames
+overlay = OverlayRenderer(broadcaster, rate_controller=display_rate_controller).start()
+
+def receive_result(content_type, body):
+    if content_type == "application/json":
+        overlay.update(json.loads(body))
+    else:
+        processed_frames.publish(body)  # Wakes up every viewer
 
 @app.route("/processed_frame", methods=["POST"])
 def receive_processed_frame():
-    """Receive processed frame data for display."""
-    global processed_frame
-    processed_frame = request.data  # Store received frame data
+    """Receive a processed frame, or its metadata as JSON, for display."""
+    receive_result(request.mimetype, request.data)
     return "Frame received", 200
 
+@app.route("/processed_stream", methods=["POST"])
+def receive_processed_stream():
+    """Receive processed frames over one long-lived chunked multipart upload."""
+    for content_type, body in read_multipart(request.stream):
+        receive_result(content_type, body)
+    return "Stream closed", 200
+
 @app.route("/display_processed")
 def display_processed():
-    """Route for displaying processed frames."""
-    def generate_processed():
-        global processed_frame
-        while True:
-            if processed_frame:
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + processed_frame + b"\r\n"
-                )
-            else:
-                pass  # Optionally yield a placeholder or wait briefly if no frame is available
+    """Route for displaying processed frames, ?max_fps=N caps this viewer.
 
+    Unless the recognizer sends whole frames, the overlay is drawn here.
+    """
+    channel = processed_frames if processed_frames.seq else overlay
+    limit_send_buffer(request.environ)
     return Response(
-        generate_processed(), mimetype="multipart/x-mixed-replace; boundary=frame"
+        channel.mjpeg_stream(request.args.get("max_fps", type=float)),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
+
+@app.route("/stream_stats")
+def stream_stats():
+    """Operating point and link measurements of every viewer."""
+    return jsonify(
+        {
+            "video_feed": feed_rate_controller.report(),
+            "display_processed": display_rate_controller.report(),
+        }
     )
 
 if __name__ == "__main__":
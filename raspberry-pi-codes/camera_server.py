@@ -1,7 +1,9 @@
-import cv2
-from flask import Flask, Response
+from flask import Flask, Response, jsonify, request
 from picamera2 import Picamera2
 
+from frame_broadcaster import FrameBroadcaster
+from rate_controller import RateController, limit_send_buffer
+
 app = Flask(__name__)
 
 camera = Picamera2()
@@ -10,21 +12,27 @@ camera.configure(
 )
 camera.start()
 
-
-def generate_frames():
-    while True:
-        frame = camera.capture_array()
-        ret, buffer = cv2.imencode(".jpg", frame)
-        frame = buffer.tobytes()
-        yield (b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+# Adapts JPEG quality, resolution and frame rate to each viewer's link. The
+# recognizer reads this feed, so it only steps down when its link cannot
+# keep up, not for going over a bitrate target
+rate_controller = RateController(target_bitrate=None)
+# One capture thread shared by every viewer
+broadcaster = FrameBroadcaster(camera.capture_array, rate_controller).start()
 
 
 @app.route("/video_feed")
 def video_feed():
+    limit_send_buffer(request.environ)
     return Response(
-        generate_frames(), mimetype="multipart/x-mixed-replace; boundary=frame"
+        broadcaster.mjpeg_stream(request.args.get("max_fps", type=float)),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
 
+@app.route("/stream_stats")
+def stream_stats():
+    return jsonify(rate_controller.report())
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
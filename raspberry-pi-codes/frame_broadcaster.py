@@ -0,0 +1,207 @@
+import threading
+import time
+
+from rate_controller import encode_jpeg
+
+
+def mjpeg_part(jpeg, seq=None, timestamp=None):
+    """One part of a multipart/x-mixed-replace; boundary=frame response"""
+    # Content-Length lets clients cut the JPEG out without scanning it, the
+    # frame number and capture time let them see what they missed and how late
+    headers = b"--frame\r\nContent-Type: image/jpeg\r\n"
+    if seq is not None:
+        headers += b"X-Frame-Seq: %d\r\n" % seq
+    if timestamp is not None:
+        headers += b"X-Timestamp: %.6f\r\n" % timestamp
+    headers += b"Content-Length: %d\r\n\r\n" % len(jpeg)
+    return headers + jpeg + b"\r\n"
+
+
+def _read_exactly(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_multipart(stream):
+    """Yield (content type, body) for the parts of a multipart upload.
+
+    Every part has to carry a Content-Length header.
+    """
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if not line.startswith(b"--"):
+            continue  # Blank line between parts
+        if line.strip().endswith(b"--"):
+            return  # Closing boundary
+
+        headers = {}
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            line = line.strip()
+            if not line:
+                break
+            key, _, value = line.partition(b":")
+            headers[key.strip().lower()] = value.strip()
+
+        body = _read_exactly(stream, int(headers.get(b"content-length", 0)))
+        if body is None:
+            return
+        yield headers.get(b"content-type", b"").decode(), body
+
+
+class FrameChannel:
+    """Latest frame under a sequence number, streamed to any number of clients.
+
+    Every client streams from frames(), which blocks until there is a frame
+    newer than the last one it sent and then hands out the newest: a slow
+    client skips what it missed instead of holding up the publisher or the
+    other clients, and nothing is sent twice. max_fps additionally caps
+    what one client receives.
+
+    Frames come in as JPEGs through publish(), or as images through
+    publish_frame(). Images are JPEG-encoded on first request, once per
+    operating point of the rate controller, if there is one.
+    """
+
+    def __init__(self, rate_controller=None):
+        self.rate_controller = rate_controller
+        self.seq = 0
+        self.published = 0.0
+        self.jpeg = None
+        self.frame = None
+        self.subscribers = 0
+        self.skipped_frames = 0
+        self._condition = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._encoded_seq = 0
+        self._encoded = {}
+
+    def publish(self, jpeg):
+        with self._condition:
+            self.seq += 1
+            self.published = time.time()
+            self.jpeg = jpeg
+            self.frame = None
+            self._condition.notify_all()
+
+    def publish_frame(self, frame):
+        with self._condition:
+            self.seq += 1
+            self.published = time.time()
+            self.jpeg = None
+            self.frame = frame
+            self._condition.notify_all()
+
+    def _encoded_jpeg(self, seq, frame, level):
+        with self._encode_lock:
+            if self._encoded_seq != seq:
+                self._encoded_seq = seq
+                self._encoded = {}
+            jpeg = self._encoded.get(level)
+            if jpeg is None:
+                jpeg = self._encoded[level] = encode_jpeg(frame, level)
+        return jpeg
+
+    def frames(self, max_fps=None):
+        """Yield (seq, publish time, JPEG) of each newest frame, for one client"""
+        rate = self.rate_controller
+        client = rate.add_client() if rate else None
+        with self._condition:
+            self.subscribers += 1
+            self._condition.notify_all()
+        seen = 0
+        next_frame = 0.0
+        try:
+            while True:
+                fps = min(filter(None, (max_fps, client and client.fps)), default=0)
+                if fps:
+                    delay = next_frame - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self._condition:
+                    self._condition.wait_for(lambda: self.seq > seen)
+                    skipped = self.seq - seen - 1 if seen else 0
+                    self.skipped_frames += skipped
+                    seen, jpeg, frame = self.seq, self.jpeg, self.frame
+                    published = self.published
+                if jpeg is None:
+                    level = rate.level(client) if rate else None
+                    jpeg = self._encoded_jpeg(seen, frame, level)
+                if jpeg is None:
+                    continue
+
+                sent = time.monotonic()
+                next_frame = sent + (1.0 / fps if fps else 0.0)
+                # Resumes once the server has written the part to the client
+                yield seen, published, jpeg
+                if rate:
+                    rate.record(client, len(jpeg), time.monotonic() - sent, skipped)
+        finally:
+            # Runs when the client disconnects and Flask closes the generator
+            with self._condition:
+                self.subscribers -= 1
+            if rate:
+                rate.remove_client(client)
+
+    def mjpeg_stream(self, max_fps=None):
+        for seq, published, jpeg in self.frames(max_fps):
+            yield mjpeg_part(jpeg, seq, published)
+
+
+class FrameBroadcaster(FrameChannel):
+    """Capture each frame once and serve it to every viewer.
+
+    A single thread reads the camera and publishes the frame. It is encoded
+    at most once per operating point, and only when a client streams it.
+    Consumers that want the frame itself, like OverlayRenderer, follow
+    raw_frames(). While nobody is watching the camera is not read at all.
+    """
+
+    def __init__(self, capture, rate_controller=None):
+        super().__init__(rate_controller)
+        # capture() returns the next frame, or None when the read failed
+        self.capture = capture
+        self.raw_subscribers = 0
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _capture_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self.subscribers > 0 or self.raw_subscribers > 0
+                )
+
+            frame = self.capture()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            self.publish_frame(frame)
+
+    def raw_frames(self):
+        """Yield each new captured frame, newest first like frames(); read only"""
+        with self._condition:
+            self.raw_subscribers += 1
+            self._condition.notify_all()
+        seen = 0
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self.seq > seen)
+                    seen, frame = self.seq, self.frame
+                yield frame
+        finally:
+            with self._condition:
+                self.raw_subscribers -= 1
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import cv2
+
+from frame_broadcaster import FrameChannel
+
+
+class OverlayRenderer(FrameChannel):
+    """Draw the recognizer's boxes and names onto the Pi's own frames.
+
+    The recognizer only sends metadata, {"frame_id", "frame_size",
+    "face_locations", "names", "confidences"} with face_locations as
+    (top, right, bottom, left) in pixels of a frame_size (width, height)
+    frame. Every new camera frame from source gets the latest metadata drawn
+    on it and is published to this channel's viewers. Metadata older than
+    max_age seconds is not drawn, so boxes go away when the recognizer stops.
+    """
+
+    def __init__(self, source, max_age=1.0, rate_controller=None):
+        super().__init__(rate_controller)
+        self.source = source
+        self.max_age = max_age
+        self.metadata = None
+        self.received_at = 0.0
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def update(self, metadata):
+        self.metadata = metadata
+        self.received_at = time.monotonic()
+
+    def _render_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.subscribers > 0)
+
+            frames = self.source.raw_frames()
+            for frame in frames:
+                if not self.subscribers:
+                    break
+                self.publish_frame(self.draw(frame.copy()))
+            # Lets the camera idle again when nobody else is watching
+            frames.close()
+
+    def draw(self, frame):
+        metadata = self.metadata
+        if metadata is None or time.monotonic() - self.received_at > self.max_age:
+            return frame
+
+        width, height = metadata.get("frame_size") or (frame.shape[1], frame.shape[0])
+        scale_x = frame.shape[1] / width
+        scale_y = frame.shape[0] / height
+        for (top, right, bottom, left), name in zip(
+            metadata["face_locations"], metadata["names"]
+        ):
+            top, bottom = int(top * scale_y), int(bottom * scale_y)
+            left, right = int(left * scale_x), int(right * scale_x)
+
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+            cv2.rectangle(
+                frame, (left, bottom - 35), (right, bottom), (0, 0, 255), cv2.FILLED
+            )
+            font = cv2.FONT_HERSHEY_DUPLEX
+            cv2.putText(
+                frame, name, (left + 6, bottom - 6), font, 1.0, (255, 255, 255), 1
+            )
+        return frame
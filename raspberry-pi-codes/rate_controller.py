@@ -0,0 +1,186 @@
+import socket
+import threading
+import time
+
+import cv2
+
+# Operating points from best to cheapest: (resolution scale, JPEG quality)
+LEVELS = (
+    (1.0, 90),
+    (1.0, 75),
+    (1.0, 60),
+    (0.75, 60),
+    (0.75, 45),
+    (0.5, 45),
+    (0.5, 30),
+)
+
+# Kernel send buffer per viewer. The default grows to megabytes, which hides
+# a congested link behind seconds of buffered video instead of a slow write
+SEND_BUFFER_BYTES = 64 * 1024
+
+
+def limit_send_buffer(environ, size=SEND_BUFFER_BYTES):
+    """Shrink the viewer's socket send buffer, where the WSGI server exposes it"""
+    sock = environ.get("werkzeug.socket")  # Flask's development server
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+
+
+def encode_jpeg(frame, level=None):
+    """JPEG-encode frame at one of LEVELS, None is full size at default quality"""
+    if level is None:
+        ret, buffer = cv2.imencode(".jpg", frame)
+    else:
+        scale, quality = LEVELS[level]
+        if scale != 1.0:
+            frame = cv2.resize(
+                frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ret else None
+
+
+class ClientRate:
+    """One viewer's operating point and what its link did in the last window"""
+
+    def __init__(self, client_id, max_fps):
+        self.client_id = client_id
+        self.level = 0
+        self.fps = max_fps
+        self.bitrate = 0.0
+        self.busy = 0.0
+        self.frame_bytes = 0
+        self.skipped_frames = 0
+        self.good_windows = 0
+        self._start_window()
+
+    def _start_window(self):
+        self.window_start = time.monotonic()
+        self.window_frames = 0
+        self.window_bytes = 0
+        self.window_busy = 0.0
+
+    def metrics(self, level=None):
+        scale, quality = LEVELS[self.level if level is None else level]
+        return {
+            "client": self.client_id,
+            "scale": scale,
+            "quality": quality,
+            "fps": round(self.fps, 1),
+            "frame_kb": round(self.frame_bytes / 1024, 1),
+            "bitrate_kbps": round(self.bitrate / 1000),
+            "busy": round(self.busy, 2),
+            "skipped_frames": self.skipped_frames,
+        }
+
+
+class RateController:
+    """Pick JPEG quality, resolution and frame rate from each viewer's link.
+
+    Every frame sent to a viewer records its size and how long the write
+    blocked. Every adjust_every frames, or right after a write slower than
+    max_latency, the viewer's window is evaluated: when the link was busy
+    writing more than half of the time, a write stalled or the bitrate went
+    over target_bitrate, the viewer steps down one of LEVELS, and at the
+    cheapest level its frame rate is cut to what got through. After
+    up_windows windows in a row with plenty of room the frame rate and then
+    the level step back up. With target_bitrate=None only a busy or stalled
+    link steps a viewer down, however many bits full quality takes.
+
+    With policy="per_client", the default, each viewer gets its own level,
+    at the cost of one encode per level in use, so one slow viewer cannot
+    degrade the others. With policy="global" every viewer gets the cheapest
+    level any viewer needs, so each frame is still encoded once.
+    """
+
+    def __init__(
+        self,
+        target_bitrate=4_000_000,
+        max_latency=0.2,
+        max_fps=30.0,
+        policy="per_client",
+        adjust_every=10,
+        up_windows=3,
+    ):
+        if policy not in ("global", "per_client"):
+            raise ValueError(f"Unknown rate policy {policy!r}")
+        self.target_bitrate = target_bitrate
+        self.max_latency = max_latency
+        self.max_fps = max_fps
+        self.policy = policy
+        self.adjust_every = adjust_every
+        self.up_windows = up_windows
+        self.clients = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def add_client(self):
+        with self._lock:
+            self._next_id += 1
+            client = self.clients[self._next_id] = ClientRate(
+                self._next_id, self.max_fps
+            )
+        return client
+
+    def remove_client(self, client):
+        with self._lock:
+            self.clients.pop(client.client_id, None)
+
+    def level(self, client):
+        if self.policy == "per_client":
+            return client.level
+        with self._lock:
+            return max((c.level for c in self.clients.values()), default=0)
+
+    def record(self, client, frame_bytes, seconds, skipped=0):
+        """One frame of frame_bytes written to client in seconds"""
+        client.frame_bytes = frame_bytes
+        client.skipped_frames += skipped
+        client.window_frames += 1
+        client.window_bytes += frame_bytes
+        client.window_busy += seconds
+        # A stalled write is acted on at once, a slow link sends few frames
+        stalled = seconds > self.max_latency
+        if stalled or client.window_frames >= self.adjust_every:
+            self._adjust(client, stalled)
+
+    def _adjust(self, client, stalled):
+        wall = max(time.monotonic() - client.window_start, 1e-3)
+        client.bitrate = client.window_bytes * 8 / wall
+        client.busy = client.window_busy / wall
+        before = (client.level, round(client.fps))
+
+        target = self.target_bitrate
+        over_target = target is not None and client.bitrate > target * 1.1
+        under_target = target is None or client.bitrate * 1.5 < target
+
+        if stalled or client.busy > 0.5 or over_target:
+            client.good_windows = 0
+            if client.level < len(LEVELS) - 1:
+                client.level += 1
+            else:
+                client.fps = max(1.0, 0.8 * client.window_frames / wall)
+        elif client.busy < 0.2 and under_target:
+            client.good_windows += 1
+            if client.good_windows >= self.up_windows:
+                client.good_windows = 0
+                if client.fps < self.max_fps:
+                    client.fps = min(self.max_fps, client.fps * 1.5)
+                elif client.level > 0:
+                    client.level -= 1
+        else:
+            client.good_windows = 0
+
+        client._start_window()
+        if (client.level, round(client.fps)) != before:
+            print(f"Rate controller: {client.metrics(self.level(client))}")
+
+    def report(self):
+        """Operating point each viewer gets, with what its link measured"""
+        with self._lock:
+            clients = list(self.clients.values())
+        return {
+            "policy": self.policy,
+            "clients": [client.metrics(self.level(client)) for client in clients],
+        }
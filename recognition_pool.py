@@ -0,0 +1,380 @@
+import multiprocessing as mp
+import os
+import time
+
+import face_recognition
+import numpy as np
+
+import time_log
+from frame_ring import FrameRing, FrameRingReader, start_resource_tracker
+
+# Worker count for a deployment, e.g. FACE_WORKERS=6 python face-rec-local.py
+DEFAULT_WORKERS = int(
+    os.environ.get("FACE_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+)
+# Faces a worker encodes in one pass, and how long it waits for them to arrive
+DEFAULT_BATCH_SIZE = int(os.environ.get("FACE_BATCH_SIZE", 8))
+DEFAULT_BATCH_WAIT_MS = float(os.environ.get("FACE_BATCH_WAIT_MS", 5.0))
+
+
+def apply_gallery_update(matcher, update):
+    """Apply one gallery update to matcher.
+
+    Updates are ("add", name, encoding), ("remove", name) or
+    ("rename", name, new_name).
+    """
+    command, name, *args = update
+    if command == "add":
+        matcher.add(name, args[0])
+    elif command == "remove":
+        matcher.remove(name)
+    elif command == "rename":
+        matcher.rename(name, args[0])
+    else:
+        raise ValueError(f"Unknown gallery update {command!r}")
+
+
+def batch_face_encodings(images, face_locations):
+    """face_recognition.face_encodings for several images in one descriptor pass.
+
+    face_locations holds one list of locations per image, one list of
+    encodings per image comes back. Landmarks are found per image, then
+    dlib computes every descriptor of the batch in a single call instead of
+    one call per face. The batched compute_face_descriptor() needs dlib
+    19.21 or newer (pip install "dlib>=19.21"); older builds fall back to
+    one face_encodings() call per image.
+    """
+    try:
+        api = face_recognition.api
+        batch_faces = []
+        for image, locations in zip(images, face_locations):
+            faces = api.dlib.full_object_detections()
+            faces.extend(api._raw_face_landmarks(image, locations, model="small"))
+            batch_faces.append(faces)
+        # Same single jitter as face_encodings()
+        descriptors = api.face_encoder.compute_face_descriptor(
+            list(images), batch_faces, 1
+        )
+    except (AttributeError, TypeError):
+        return [
+            face_recognition.face_encodings(image, locations)
+            for image, locations in zip(images, face_locations)
+        ]
+    return [
+        [np.array(descriptor) for descriptor in image_descriptors]
+        for image_descriptors in descriptors
+    ]
+
+
+def _gather_batch(job_queue, job, batch_size, max_wait):
+    """job plus the jobs arriving within max_wait seconds, up to batch_size faces.
+
+    Returns (jobs, stop), stop is True when the poison pill came in meanwhile.
+    """
+    jobs = [job]
+    faces = len(job["face_locations"])
+    deadline = time.monotonic() + max_wait
+    while faces < batch_size:
+        timeout = deadline - time.monotonic()
+        try:
+            if timeout > 0:
+                job = job_queue.get(timeout=timeout)
+            else:  # Past the deadline only what is already queued gets taken
+                job = job_queue.get_nowait()
+        except mp.queues.Empty:
+            break
+        if job is None:
+            return jobs, True
+        jobs.append(job)
+        faces += len(job["face_locations"])
+    return jobs, False
+
+
+def recognition_worker(
+    job_queue,
+    result_queue,
+    control_queue,
+    matcher,
+    min_confidence=0.0,
+    batch_size=1,
+    max_wait_ms=0.0,
+):
+    """Process function that runs in each worker of the pool.
+
+    Faces from up to batch_size faces' worth of jobs, frames of one or
+    several streams, are encoded together, waiting at most max_wait_ms for
+    a batch to fill. Results still go back one per job.
+    """
+    ring_reader = FrameRingReader()
+    gallery_version = 0
+    stop = False
+    while not stop:
+        try:
+            job = job_queue.get()
+            if job is None:  # Poison pill for clean shutdown
+                break
+            jobs, stop = _gather_batch(
+                job_queue, job, batch_size, max_wait_ms / 1000.0
+            )
+
+            # Every gallery update sent before these jobs were queued applies to them
+            while gallery_version < jobs[-1]["gallery_version"]:
+                gallery_version, update = control_queue.get()
+                apply_gallery_update(matcher, update)
+
+            # Read the frames in place from shared memory
+            frames = [ring_reader.read(job) for job in jobs]
+            # Skip frames overwritten before we got to them
+            jobs = [job for job, frame in zip(jobs, frames) if frame is not None]
+            frames = [frame for frame in frames if frame is not None]
+            if not jobs:
+                continue
+
+            with time_log.timed("encode"):
+                batch_encodings = batch_face_encodings(
+                    frames, [job["face_locations"] for job in jobs]
+                )
+            frames = None
+
+            for job, face_encodings in zip(jobs, batch_encodings):
+                if not ring_reader.is_current(job):
+                    # The capture loop reused the slot while we were encoding
+                    continue
+
+                face_names, face_confidences = matcher.identify(
+                    face_encodings, min_confidence=min_confidence
+                )
+                unknown_encodings = [
+                    face_encoding
+                    for face_encoding, name in zip(face_encodings, face_names)
+                    if name == "Unknown"
+                ]
+
+                result_queue.put(
+                    {
+                        "frame_id": job["frame_id"],
+                        "timestamp": job["timestamp"],
+                        "face_locations": job["face_locations"],
+                        "track_ids": job["track_ids"],
+                        "stream": job["stream"],
+                        "names": face_names,
+                        "confidences": face_confidences,
+                        "unknown_encodings": unknown_encodings,
+                        "gallery_version": gallery_version,
+                        "batch_size": len(jobs),
+                        # Worker timings travel back to be merged in the main process
+                        "profile": (
+                            time_log.profiler.drain() if time_log.enabled else None
+                        ),
+                    }
+                )
+
+        except Exception as e:
+            print(f"Error in recognition_worker: {e}")
+            continue
+
+    ring_reader.close()
+
+
+class RecognitionPool:
+    """Pool of encoder processes fed with frame jobs from the capture loop.
+
+    Every job carries a frame ID and capture timestamp. Workers finish out of
+    order, so results() hands them back sorted by frame ID and drops any that
+    are older than max_age seconds or than what was already delivered: per
+    track for jobs submitted with track_ids, as a later frame's result only
+    supersedes the tracks it covered, and per frame otherwise. Jobs submitted
+    with a stream, e.g. a camera name, are ordered per stream, so several
+    cameras can share one pool.
+
+    Identities are added, removed and renamed live through a control queue
+    per worker, without restarting the workers or losing frames in flight.
+
+    A worker encodes the faces of up to batch_size faces' worth of queued
+    jobs in one pass, waiting up to max_wait_ms for more to arrive. With a
+    single face per frame and several cameras or a backlog this saves most
+    of the per-call overhead; batch_size=1 encodes every frame on its own.
+    """
+
+    def __init__(
+        self,
+        matcher,
+        n_workers=None,
+        min_confidence=0.0,
+        max_age=1.0,
+        batch_size=DEFAULT_BATCH_SIZE,
+        max_wait_ms=DEFAULT_BATCH_WAIT_MS,
+    ):
+        self.n_workers = n_workers or DEFAULT_WORKERS
+        self.max_age = max_age
+        self.batch_size = batch_size
+        # Newest frame ID delivered per stream, None for jobs without a stream,
+        # and (frame ID, timestamp) per (stream, track ID) for jobs with tracks
+        self.last_frame_ids = {}
+        self.last_track_frame_ids = {}
+        self.stale_results = 0
+
+        # One job waiting per worker keeps every core busy without queueing old
+        # frames, a batch worth of them lets a batch form
+        queue_size = max(self.n_workers, batch_size)
+        self.job_queue = mp.Queue(maxsize=queue_size)
+        # Every frame a worker batches, every queued job and the one being written
+        self.ring_slots = self.n_workers * batch_size + queue_size + 1
+        self.result_queue = mp.Queue()
+        # One ring per frame shape, the detection scale may change under way
+        self.rings = {}
+        # Every worker holds its own copy of the gallery, updates go to each
+        self.matcher = matcher
+        self.gallery_version = 0
+        self.control_queues = []
+
+        start_resource_tracker()
+        self.workers = []
+        for _ in range(self.n_workers):
+            control_queue = mp.Queue()
+            worker = mp.Process(
+                target=recognition_worker,
+                args=(
+                    self.job_queue,
+                    self.result_queue,
+                    control_queue,
+                    matcher,
+                    min_confidence,
+                    batch_size,
+                    max_wait_ms,
+                ),
+            )
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+            self.control_queues.append(control_queue)
+
+    def submit(
+        self,
+        frame_id,
+        rgb_small_frame,
+        face_locations,
+        track_ids=None,
+        stream=None,
+        timestamp=None,
+    ):
+        """Queue a frame for encoding, returns False if every worker is busy.
+
+        track_ids, one per face location, are handed back with the result so
+        it can be attached to the tracks it was computed for. stream comes
+        back with the result too, frame IDs only need to grow per stream.
+        timestamp is the frame's capture time.time(), now if None.
+        """
+        # Only copy into the ring when a worker can take the frame
+        if self.job_queue.full():
+            return False
+
+        ring = self.rings.get(rgb_small_frame.shape)
+        if ring is None:
+            ring = self.rings[rgb_small_frame.shape] = FrameRing(
+                rgb_small_frame.shape, n_slots=self.ring_slots
+            )
+        slot, seq = ring.write(rgb_small_frame)
+        self.job_queue.put_nowait(
+            {
+                "ring": ring.spec,
+                "slot": slot,
+                "seq": seq,
+                "frame_id": frame_id,
+                "timestamp": time.time() if timestamp is None else timestamp,
+                "face_locations": face_locations,
+                "track_ids": track_ids,
+                "stream": stream,
+                "gallery_version": self.gallery_version,
+            }
+        )
+        return True
+
+    def add_identity(self, name, encoding):
+        """Enroll an already computed encoding, e.g. from unknown_encodings"""
+        self._update_gallery(("add", name, np.asarray(encoding, dtype=np.float32)))
+
+    def remove_identity(self, name):
+        self._update_gallery(("remove", name))
+
+    def rename_identity(self, name, new_name):
+        self._update_gallery(("rename", name, new_name))
+
+    def _update_gallery(self, update):
+        """Apply update here and in every worker before its next job.
+
+        Results carry the gallery_version they were matched with, so callers
+        can tell results computed before the update from those after it.
+        """
+        apply_gallery_update(self.matcher, update)
+        self.gallery_version += 1
+        for control_queue in self.control_queues:
+            control_queue.put((self.gallery_version, update))
+
+    def queue_depth(self):
+        """Jobs waiting for a free worker, 0 where the platform cannot tell"""
+        try:
+            return self.job_queue.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def results(self):
+        """Return the finished results that are still fresh, oldest frame first"""
+        results = []
+        try:
+            while True:
+                results.append(self.result_queue.get_nowait())
+        except mp.queues.Empty:
+            pass
+
+        now = time.time()
+        fresh = []
+        for result in sorted(results, key=lambda r: r["frame_id"]):
+            if result["profile"]:
+                time_log.profiler.merge(result["profile"])
+            if self._is_stale(result, now):
+                self.stale_results += 1
+                continue
+            stream, frame_id = result["stream"], result["frame_id"]
+            self.last_frame_ids[stream] = max(
+                frame_id, self.last_frame_ids.get(stream, -1)
+            )
+            for track_id in result["track_ids"] or ():
+                key = stream, track_id
+                if frame_id > self.last_track_frame_ids.get(key, (-1, 0.0))[0]:
+                    self.last_track_frame_ids[key] = frame_id, result["timestamp"]
+            fresh.append(result)
+
+        if self.max_age:
+            # Any result older than these would be dropped for its age anyway
+            self.last_track_frame_ids = {
+                key: last
+                for key, last in self.last_track_frame_ids.items()
+                if now - last[1] <= self.max_age
+            }
+        return fresh
+
+    def _is_stale(self, result, now):
+        if self.max_age and now - result["timestamp"] > self.max_age:
+            return True
+        stream, frame_id = result["stream"], result["frame_id"]
+        if not result["track_ids"]:
+            return frame_id <= self.last_frame_ids.get(stream, -1)
+        # Stale once every one of its tracks has a result from a later frame
+        return all(
+            frame_id <= self.last_track_frame_ids.get((stream, track_id), (-1, 0.0))[0]
+            for track_id in result["track_ids"]
+        )
+
+    def close(self):
+        for _ in self.workers:
+            try:
+                self.job_queue.put(None, timeout=1)  # Send poison pill
+            except mp.queues.Full:
+                break  # Workers are stuck, terminate them below
+        for worker in self.workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+        for ring in self.rings.values():
+            ring.close()
@@ -0,0 +1,237 @@
+import queue
+import threading
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+import time_log
+from frame_scale import FrameScale
+from recognition_pool import batch_face_encodings
+from time_log import timed
+
+
+class Overloaded(Exception):
+    """The service is shedding load, the client should retry later"""
+
+
+class _Request:
+    def __init__(self, images, deadline):
+        # (rgb detection frame, FrameScale to map its locations back) per image
+        self.images = images
+        self.deadline = deadline
+        self.enqueued = time.perf_counter()
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def decode_image(data, frame_scale):
+    """JPEG/PNG bytes to an RGB detection frame, None if they are no image"""
+    with timed("decode"):
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+    # A contiguous RGB copy, newer dlib builds reject the flipped view
+    return np.ascontiguousarray(frame_scale.shrink(frame))
+
+
+class RecognitionService:
+    """Recognize faces in posted images, many requests' images at a time.
+
+    recognize() queues a request and waits for its result. One batcher
+    thread per n_threads takes queued requests until it holds max_batch
+    images or max_wait_ms has passed since the first, runs detection over
+    all of them, encodes every face of the batch in one descriptor pass and
+    matches them against the gallery in one matrix product.
+
+    At most max_queue requests wait. When the queue is full, or a request
+    waited longer than timeout seconds before a batcher got to it, the
+    request is shed with Overloaded instead of making every client slower.
+    """
+
+    def __init__(
+        self,
+        matcher,
+        max_batch=8,
+        max_wait_ms=10.0,
+        max_queue=32,
+        timeout=2.0,
+        min_confidence=0.0,
+        n_threads=1,
+    ):
+        self.matcher = matcher
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self.min_confidence = min_confidence
+        self.requests = queue.Queue(maxsize=max_queue)
+
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._batch_loop, daemon=True)
+            for _ in range(n_threads)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def recognize(self, images, frame_scale=None):
+        """Recognize faces in a list of encoded images.
+
+        Returns one {"face_locations", "names", "confidences"} per image, in
+        pixels of the posted image, None for data that is no image. Raises
+        Overloaded when the request was shed.
+        """
+        frame_scale = frame_scale or FrameScale(1.0)
+        decoded = [decode_image(data, frame_scale) for data in images]
+        request = _Request(
+            [(image, frame_scale) for image in decoded if image is not None],
+            deadline=time.perf_counter() + self.timeout,
+        )
+        if request.images:
+            try:
+                self.requests.put_nowait(request)
+            except queue.Full:
+                with self._stats_lock:
+                    self.shed_requests += 1
+                raise Overloaded(f"{self.requests.maxsize} requests already queued")
+            # A batcher answers or sheds every request it takes, well within this
+            if not request.done.wait(self.timeout + 60):
+                raise Overloaded("No answer from the batcher")
+            if request.error is not None:
+                raise request.error
+        else:
+            request.results = []
+
+        results = iter(request.results or [])
+        response = [None if image is None else next(results) for image in decoded]
+        with self._stats_lock:
+            self.served_images += len(request.images)
+            self.latency.record(time.perf_counter() - request.enqueued)
+        return response
+
+    def _take_batch(self):
+        try:
+            request = self.requests.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [request]
+        images = len(request.images)
+        deadline = time.perf_counter() + self.max_wait
+        while images < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    request = self.requests.get(timeout=timeout)
+                else:  # Past the deadline only what is already queued gets taken
+                    request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            images += len(request.images)
+        return batch
+
+    def _batch_loop(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch()
+            now = time.perf_counter()
+            live = []
+            for request in batch:
+                with self._stats_lock:
+                    self.queue_wait.record(now - request.enqueued)
+                if now > request.deadline:
+                    # The client has waited long enough, answering late helps no one
+                    with self._stats_lock:
+                        self.shed_requests += 1
+                    request.error = Overloaded("Request timed out in the queue")
+                    request.done.set()
+                else:
+                    live.append(request)
+            if not live:
+                continue
+
+            try:
+                self._process(live)
+            except Exception as e:
+                print(f"Error in recognition service: {e}")
+                for request in live:
+                    request.error = e
+            for request in live:
+                request.done.set()
+
+    def _process(self, batch):
+        images = [image for request in batch for image, _ in request.images]
+        scales = [scale for request in batch for _, scale in request.images]
+
+        with timed("detect"):
+            face_locations = [
+                face_recognition.face_locations(image) for image in images
+            ]
+        with timed("encode"):
+            face_encodings = batch_face_encodings(images, face_locations)
+        # Every face of the batch against the gallery in one go
+        names, confidences = self.matcher.identify(
+            [encoding for encodings in face_encodings for encoding in encodings],
+            min_confidence=self.min_confidence,
+        )
+
+        results = []
+        start = 0
+        for locations, frame_scale in zip(face_locations, scales):
+            end = start + len(locations)
+            results.append(
+                {
+                    "face_locations": [
+                        frame_scale.to_frame(location) for location in locations
+                    ],
+                    "names": names[start:end],
+                    "confidences": confidences[start:end],
+                }
+            )
+            start = end
+
+        start = 0
+        for request in batch:
+            request.results = results[start : start + len(request.images)]
+            start += len(request.images)
+        with self._stats_lock:
+            self.batches += 1
+            self.batched_images += len(images)
+
+    def reset_stats(self):
+        """Start counting from zero, e.g. between load test runs"""
+        with self._stats_lock:
+            self.served_images = 0
+            self.shed_requests = 0
+            self.batches = 0
+            self.batched_images = 0
+            self.latency = time_log.Histogram()
+            self.queue_wait = time_log.Histogram()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queued_requests": self.requests.qsize(),
+                "max_queue": self.requests.maxsize,
+                "served_images": self.served_images,
+                "shed_requests": self.shed_requests,
+                "batches": self.batches,
+                "mean_batch_images": (
+                    round(self.batched_images / self.batches, 2)
+                    if self.batches
+                    else None
+                ),
+                "latency": self.latency.summary(),
+                "queue_wait": self.queue_wait.summary(),
+            }
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
@@ -0,0 +1,75 @@
+import threading
+import time
+
+from channels import LatestChannel
+from time_log import timed
+
+
+class LatestFrameReader:
+    """Drain a capture source in the background and keep only the newest frame.
+
+    cv2.VideoCapture on an HTTP/MJPEG stream buffers every frame the Pi sends
+    and CAP_PROP_BUFFERSIZE does not apply to it, so a slow reader falls
+    further and further behind. This reader decodes frames as fast as they
+    arrive and overwrites the previous one, so whoever asks always gets the
+    newest frame and latency stays bounded by one frame interval.
+    """
+
+    def __init__(self, video_capture):
+        self.video_capture = video_capture
+        # Items are (frame_id, arrival timestamp, frame)
+        self.frames = LatestChannel()
+        self.dropped_frames = 0
+        self.failed_reads = 0
+        self._consumed_version = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _read_loop(self):
+        frame_id = 0
+        while not self._stopped.is_set():
+            with timed("capture"):
+                ret, frame = self.video_capture.read()
+            if not ret:
+                self.failed_reads += 1
+                time.sleep(0.01)
+                continue
+
+            frame_id += 1
+            if self.frames.version > self._consumed_version:
+                # Nobody took the previous frame before this one replaced it
+                self.dropped_frames += 1
+            self.frames.put((frame_id, time.time(), frame))
+
+    def latest(self):
+        """Return the newest (frame_id, timestamp, frame) without blocking, or None"""
+        version, item = self.frames.latest()
+        self._consumed_version = version
+        return item
+
+    def next(self, timeout=5.0):
+        """Wait for a frame newer than the last one taken, returns the item or None"""
+        version, item = self.frames.get(self._consumed_version, timeout=timeout)
+        if item is not None:
+            self._consumed_version = version
+        return item
+
+    def read(self, timeout=5.0):
+        """cv2.VideoCapture style (ret, frame) on top of next()"""
+        item = self.next(timeout=timeout)
+        if item is None:
+            return False, None
+        return True, item[2]
+
+    def stop(self):
+        self._stopped.set()
+        self.frames.close()
+        self._thread.join(timeout=1)
+
+    def release(self):
+        self.stop()
+        self.video_capture.release()
@@ -0,0 +1,36 @@
+import numpy as np
+
+import face_utils
+
+
+def test_faceless_image_is_not_encoded_again(tmp_path, monkeypatch):
+    images = tmp_path / "images"
+    images.mkdir()
+    (images / "alice.jpg").write_bytes(b"alice")
+    (images / "wall.jpg").write_bytes(b"wall")
+
+    encoded = []
+
+    def face_encodings(image):
+        encoded.append(image)
+        return [np.ones(128)] if image == b"alice" else []
+
+    monkeypatch.setattr(
+        face_utils.face_recognition,
+        "load_image_file",
+        lambda path: open(path, "rb").read(),
+        raising=False,
+    )
+    monkeypatch.setattr(
+        face_utils.face_recognition, "face_encodings", face_encodings, raising=False
+    )
+
+    encodings, names = face_utils.load_know_images(str(images))
+    assert names == ["alice"]
+    assert sorted(encoded) == [b"alice", b"wall"]
+
+    encoded.clear()
+    encodings, names = face_utils.load_know_images(str(images))
+    assert names == ["alice"]
+    assert np.array_equal(encodings[0], np.ones(128))
+    assert encoded == []
@@ -0,0 +1,50 @@
+import pytest
+
+import frame_scheduler
+from frame_scheduler import AdaptiveScheduler
+
+
+def run(monkeypatch, inline, source_fps, processing, frames=300):
+    """Feed frames from a simulated source, processing those picked"""
+    clock = [0.0]
+    monkeypatch.setattr(frame_scheduler.time, "perf_counter", lambda: clock[0])
+    scheduler = AdaptiveScheduler(inline=inline)
+    for _ in range(frames):
+        clock[0] += 1.0 / source_fps
+        if scheduler.should_process():
+            if inline:
+                clock[0] += processing
+            scheduler.record_processing(processing)
+        scheduler.frame_done()
+    return scheduler
+
+
+@pytest.mark.parametrize("inline", [True, False])
+def test_slow_source_with_cheap_processing_processes_every_frame(
+    monkeypatch, inline
+):
+    scheduler = run(monkeypatch, inline, source_fps=10, processing=0.001)
+    assert scheduler.interval == 1
+    assert scheduler.skipped_frames == 0
+    assert scheduler.identity_age < 0.01
+
+
+@pytest.mark.parametrize("inline", [True, False])
+def test_backs_off_when_processing_is_the_bottleneck(monkeypatch, inline):
+    scheduler = run(monkeypatch, inline, source_fps=30, processing=0.1)
+    assert scheduler.interval > 1
+    assert scheduler.skipped_frames > 0
+
+
+def test_slow_source_recovers_from_a_raised_interval(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(frame_scheduler.time, "perf_counter", lambda: clock[0])
+    scheduler = AdaptiveScheduler()
+    scheduler.interval = scheduler.max_interval
+    for _ in range(300):
+        clock[0] += 0.1
+        if scheduler.should_process():
+            clock[0] += 0.001
+            scheduler.record_processing(0.001)
+        scheduler.frame_done()
+    assert scheduler.interval == 1
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from face_matcher import FaceMatcher
+from recognition_pool import RecognitionPool
+
+
+@pytest.fixture
+def pool():
+    pool = RecognitionPool(FaceMatcher([], []), n_workers=1, batch_size=1)
+    yield pool
+    pool.close()
+
+
+def finish(pool, frame_id, track_ids, stream=None):
+    """Hand back a result as a worker would"""
+    pool.result_queue.put(
+        {
+            "frame_id": frame_id,
+            "timestamp": time.time(),
+            "face_locations": [(0, 1, 1, 0)] * len(track_ids or [None]),
+            "track_ids": track_ids,
+            "stream": stream,
+            "names": ["Unknown"] * len(track_ids or [None]),
+            "confidences": [0.0] * len(track_ids or [None]),
+            "unknown_encodings": [],
+            "gallery_version": 0,
+            "batch_size": 1,
+            "profile": None,
+        }
+    )
+
+
+def collect(pool):
+    # The result queue's feeder thread needs a moment
+    time.sleep(0.1)
+    return pool.results()
+
+
+def test_later_job_for_other_tracks_does_not_drop_earlier_result(pool):
+    finish(pool, 2, [7])
+    assert [r["frame_id"] for r in collect(pool)] == [2]
+    finish(pool, 1, [3])
+    assert [r["frame_id"] for r in collect(pool)] == [1]
+    assert pool.stale_results == 0
+
+
+def test_later_result_for_the_same_track_drops_earlier_one(pool):
+    finish(pool, 2, [3])
+    collect(pool)
+    finish(pool, 1, [3])
+    assert collect(pool) == []
+    assert pool.stale_results == 1
+
+
+def test_untracked_results_stay_ordered_per_stream(pool):
+    finish(pool, 2, None, stream="a")
+    collect(pool)
+    finish(pool, 1, None, stream="a")
+    finish(pool, 1, None, stream="b")
+    assert [r["stream"] for r in collect(pool)] == ["b"]
+    assert pool.stale_results == 1
@@ -0,0 +1,36 @@
+import importlib
+
+import pytest
+
+import time_log
+
+
+@pytest.fixture
+def reload_with(monkeypatch):
+    def reload(value):
+        monkeypatch.setenv("FACE_PROFILE", value)
+        return importlib.reload(time_log)
+
+    yield reload
+    monkeypatch.delenv("FACE_PROFILE", raising=False)
+    importlib.reload(time_log)
+
+
+@pytest.mark.parametrize(
+    "value, enabled, interval",
+    [
+        ("on", True, None),
+        ("10", True, 10.0),
+        ("0.5", True, 0.5),
+        ("0", False, None),
+        ("0.0", False, None),
+        ("off", False, None),
+        ("False", False, None),
+        ("no", False, None),
+        ("", False, None),
+    ],
+)
+def test_face_profile_parsing(reload_with, value, enabled, interval):
+    module = reload_with(value)
+    assert module.enabled is enabled
+    assert module.report_interval == interval
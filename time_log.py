@@ -1,18 +1,214 @@
+import functools
+import math
+import multiprocessing as mp
+import os
+import threading
 import time
 
-from collections import defaultdict
+# FACE_PROFILE=on turns profiling on, FACE_PROFILE=N also reports every N seconds;
+# unset, empty, 0, off, false and no leave it off
+_PROFILE_ENV = os.environ.get("FACE_PROFILE", "").strip()
+_PROFILE_OFF = ("", "off", "false", "no")
 
-steps = defaultdict(lambda: {"time": 0, "start": None, "counter": 0})
+# Log-spaced buckets from 1us up, each 2**(1/8) (~9%) wider than the last
+MIN_SECONDS = 1e-6
+BUCKETS_PER_DOUBLING = 8
+N_BUCKETS = 8 * 28  # Up to ~4.5 minutes, the last bucket takes anything longer
+_BUCKET_SCALE = BUCKETS_PER_DOUBLING / math.log(2)
+
+try:
+    report_interval = float(_PROFILE_ENV)
+except ValueError:  # Not set, or on/off style
+    report_interval = None
+enabled = _PROFILE_ENV.lower() not in _PROFILE_OFF and report_interval != 0
+if report_interval is not None and not report_interval > 0:
+    report_interval = None
+
+
+def _bucket(seconds):
+    if seconds <= MIN_SECONDS:
+        return 0
+    index = int(math.log(seconds / MIN_SECONDS) * _BUCKET_SCALE) + 1
+    return min(index, N_BUCKETS - 1)
+
+
+def _bucket_upper(index):
+    return MIN_SECONDS * 2 ** (index / BUCKETS_PER_DOUBLING)
+
+
+class Histogram:
+    """Latency histogram with log-spaced buckets, percentiles within ~9%"""
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = _bucket(seconds)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_bucket_upper(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Count and latencies in milliseconds, ready for JSON"""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Profiler:
+    """Per-stage latency histograms, safe to record into from any thread"""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._last_report = time.perf_counter()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.record(seconds)
+
+        if report_interval and mp.parent_process() is None:
+            now = time.perf_counter()
+            if now - self._last_report >= report_interval:
+                self._last_report = now
+                print(self.report())
+
+    def drain(self):
+        """Return the histograms recorded so far and start over.
+
+        Worker processes ship the result to the main process, which merges it.
+        """
+        with self._lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+    def merge(self, stages):
+        with self._lock:
+            for stage, other in stages.items():
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram()
+                histogram.merge(other)
+
+    def summary(self):
+        with self._lock:
+            return {stage: h.summary() for stage, h in sorted(self.stages.items())}
+
+    def report(self):
+        lines = ["stage            count   mean    p50    p95    p99    max (ms)"]
+        for stage, s in self.summary().items():
+            lines.append(
+                f"{stage:<14} {s['count']:>7} {s['mean_ms']:6.1f} {s['p50_ms']:6.1f}"
+                f" {s['p95_ms']:6.1f} {s['p99_ms']:6.1f} {s['max_ms']:6.1f}"
+            )
+        return "\n".join(lines)
+
+
+profiler = Profiler()
+
+
+class _Timer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timed(stage):
+    """Time a block (with timed("detect"): ...), a no-op while profiling is off"""
+    if not enabled:
+        return _NOOP_TIMER
+    return _Timer(stage)
+
+
+def profiled(stage):
+    """Decorator version of timed(), checks whether profiling is on per call"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+_step_starts = threading.local()
 
 
 def time_step(step):
-    return
-    if steps[step]["start"]:
-        steps[step]["time"] += time.time() - steps[step]["start"]
-        steps[step]["counter"] += 1
-        steps[step]["start"] = None
-        print(
-            f"Step '{step}' ran {steps[step]['counter']} times. in average took {steps[step]['time']/steps[step]['counter']}s to run."
-        )
+    """Call once to start and once more to stop timing step, per thread"""
+    if not enabled:
+        return
+    starts = _step_starts.__dict__
+    start = starts.pop(step, None)
+    if start is None:
+        starts[step] = time.perf_counter()
     else:
-        steps[step]["start"] = time.time()
+        profiler.record(step, time.perf_counter() - start)
+
+
+def enable(interval=None):
+    global enabled, report_interval
+    enabled = True
+    report_interval = interval
+
+
+def disable():
+    global enabled
+    enabled = False